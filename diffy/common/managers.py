@@ -30,6 +30,7 @@ class InstanceManager(object):
 
     def remove(self, class_path):
         self.cache = None
+        self.loaded.pop(class_path, None)
         self.class_list.remove(class_path)
 
     def update(self, class_list):
@@ -37,8 +38,36 @@ class InstanceManager(object):
         Updates the class list and wipes the cache.
         """
         self.cache = None
+        self.loaded = {}
         self.class_list = class_list
 
+    def is_loaded(self, class_path):
+        return class_path in self.loaded
+
+    def load(self, class_path):
+        """
+        Imports a single class, returning its cached instance, or None if it
+        could not be imported.
+        """
+        if class_path in self.loaded:
+            return self.loaded[class_path]
+
+        result = None
+        module_name, class_name = class_path.rsplit(".", 1)
+        try:
+            module = __import__(module_name, {}, {}, class_name)
+            cls = getattr(module, class_name)
+            result = cls() if self.instances else cls
+
+        except InvalidConfiguration as e:
+            logger.warning(f"Plugin '{class_name}' may not work correctly. {e}")
+
+        except Exception as e:
+            logger.exception(f"Unable to import {class_path}. Reason: {e}")
+
+        self.loaded[class_path] = result
+        return result
+
     def all(self):
         """
         Returns a list of cached instances.
@@ -53,21 +82,9 @@ class InstanceManager(object):
 
         results = []
         for cls_path in class_list:
-            module_name, class_name = cls_path.rsplit(".", 1)
-            try:
-                module = __import__(module_name, {}, {}, class_name)
-                cls = getattr(module, class_name)
-                if self.instances:
-                    results.append(cls())
-                else:
-                    results.append(cls)
-
-            except InvalidConfiguration as e:
-                logger.warning(f"Plugin '{class_name}' may not work correctly. {e}")
-
-            except Exception as e:
-                logger.exception(f"Unable to import {cls_path}. Reason: {e}")
-                continue
+            result = self.load(cls_path)
+            if result is not None:
+                results.append(result)
 
         self.cache = results
 
@@ -6,8 +6,18 @@
 .. moduleauthor:: Forest Monsen <fmonsen@netflix.com>
 .. moduleauthor:: Kevin Glisson <kglisson@netflix.com>
 """
+import json
+import base64
+import hashlib
+import time
 import logging
-import pkg_resources
+import threading
+from typing import Any, List, Optional
+
+try:
+    from importlib import metadata as importlib_metadata
+except ImportError:  # python < 3.8
+    import importlib_metadata
 
 
 logger = logging.getLogger(__name__)
@@ -19,25 +29,101 @@ def chunk(l, n):
         yield l[i : i + n]
 
 
+class RateLimiter(object):
+    """Thread safe limiter spacing calls out to at most `rate` per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Blocks until the caller is allowed to make its next call."""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+def encode_cursor(key: str) -> str:
+    """Encodes the last key of a page into an opaque pagination cursor."""
+    return base64.urlsafe_b64encode(key.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[str]:
+    """Decodes a pagination cursor back into the key to continue after."""
+    if not cursor:
+        return None
+    return base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+
+
+def get_rows(stdout: Any) -> List[Any]:
+    """Normalises collected osquery output into a list of rows."""
+    if not stdout:
+        return []
+    if isinstance(stdout, list):
+        return stdout
+    return [stdout]
+
+
+def row_hash(row: Any, columns: Optional[List[str]] = None) -> str:
+    """Creates a stable hash for an osquery row, optionally limited to the given columns."""
+    if columns and isinstance(row, dict):
+        row = {c: row.get(c) for c in columns}
+    data = json.dumps(row, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()  # nosec: not used for security
+
+
+def get_row_hashes(item: dict) -> List[str]:
+    """Returns the hash of each row of an item's output, using the precomputed index when present."""
+    if item.get("row_hashes") is not None:
+        return item["row_hashes"]
+    return [row_hash(r) for r in get_rows(item.get("stdout"))]
+
+
+def command_hash(command: Any) -> str:
+    """Creates a stable identifier for a payload command, or list of commands run together."""
+    data = json.dumps(command, sort_keys=True)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]  # nosec: not used for security
+
+
+def options_hash(options: dict) -> str:
+    """Creates a stable identifier for a set of plugin options."""
+    data = json.dumps(options, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]  # nosec: not used for security
+
+
+def content_hash(stdout: Any) -> str:
+    """Creates a hash of collection output that ignores row order and formatting."""
+    hashes = sorted(row_hash(r) for r in get_rows(stdout))
+    return hashlib.sha1("".join(hashes).encode("utf-8")).hexdigest()  # nosec: not used for security
+
+
+def get_entry_points(group: str) -> list:
+    """Lists the entry points of a group across installed packages, without importing them."""
+    entry_points = importlib_metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return list(entry_points.select(group=group))
+    return list(entry_points.get(group, []))
+
+
 def install_plugins():
     """
     Installs plugins associated with diffy
     :return:
     """
-    from diffy.plugins.base import register
+    from diffy.plugins.base import plugins
 
     # entry_points={
     #    'diffy.plugins': [
     #         'ssm = diffy_aws.plugin:SSMCollectionPlugin'
     #     ],
     # },
-    for ep in pkg_resources.iter_entry_points("diffy.plugins"):
-        logger.info(f"Loading plugin {ep.name}")
-        try:
-            plugin = ep.load()
-        except Exception:
-            import traceback
-
-            logger.error(f"Failed to load plugin {ep.name}:{traceback.format_exc()}")
-        else:
-            register(plugin)
+    # plugins are only registered by name here, they are imported when first used
+    for ep in get_entry_points("diffy.plugins"):
+        logger.debug(f"Registering plugin {ep.name}")
+        module_name, _, attr = ep.value.partition(":")
+        plugins.register_entry_point(ep.name, f"{module_name.strip()}.{attr.strip()}")
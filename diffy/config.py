@@ -206,18 +206,72 @@ DEFAULTS: Dict[str, Union[Iterable[Any], Path, str, bool, None]] = {
     # DIFFY_LOCAL_FILE_DIRECTORY: When saving results to a local file, we use
     # this directory to build the final location of the output.
     'DIFFY_LOCAL_FILE_DIRECTORY': Path(__file__).resolve().parent.parent.absolute(),
+    # DIFFY_LOCAL_FILE_CONTENT_ADDRESSED: When enabled, collection output is
+    # stored as gzip compressed blobs keyed by the hash of their content, with
+    # a small manifest per key, so identical output from many hosts is only
+    # written once.
+    'DIFFY_LOCAL_FILE_CONTENT_ADDRESSED': False,
     # DIFFY_AWS_PERSISTENCE_BUCKET: An AWS S3 bucket name describing the
     # location where Diffy will save its output.
     'DIFFY_AWS_PERSISTENCE_BUCKET': 'mybucket',
+    # DIFFY_AWS_S3_MAX_WORKERS: The number of objects Diffy will fetch from
+    # S3 concurrently when reading many results at once.
+    'DIFFY_AWS_S3_MAX_WORKERS': 16,
+    # DIFFY_AWS_S3_MULTIPART_THRESHOLD: The size in bytes above which results
+    # are uploaded to S3 in multiple parts.
+    'DIFFY_AWS_S3_MULTIPART_THRESHOLD': 8 * 1024 * 1024,
+    # DIFFY_AWS_S3_CACHE_SIZE: The number of documents read from S3 that are
+    # kept in memory, revalidated with their ETag before reuse.
+    'DIFFY_AWS_S3_CACHE_SIZE': 128,
+    # DIFFY_AWS_S3_CACHE_DIRECTORY: When set, documents read from S3 are also
+    # cached in this directory so they survive between runs.
+    'DIFFY_AWS_S3_CACHE_DIRECTORY': None,
+    # DIFFY_AWS_ACCOUNT_NUMBER: The account Diffy operates in when none is
+    # given. When unset it is looked up once per process from the caller identity.
+    'DIFFY_AWS_ACCOUNT_NUMBER': None,
+    # DIFFY_AWS_OFFLINE: Whether Diffy should avoid looking up the caller
+    # identity, e.g. on hosts without AWS credentials or network access.
+    'DIFFY_AWS_OFFLINE': False,
+    # DIFFY_AWS_IDENTITY_TIMEOUT: The number of seconds Diffy will wait for
+    # the caller identity lookup before falling back to the default account.
+    'DIFFY_AWS_IDENTITY_TIMEOUT': 2,
+    # DIFFY_AWS_IDENTITY_RETRY_INTERVAL: The number of seconds Diffy will use
+    # the default account after a failed identity lookup before trying again.
+    'DIFFY_AWS_IDENTITY_RETRY_INTERVAL': 60,
     # DIFFY_AWS_ASSUME_ROLE: An AWS IAM role into which Diffy will assume to
     # take its actions.
     'DIFFY_AWS_ASSUME_ROLE': 'Diffy',
+    # DIFFY_AWS_AUTO_SCALING_CACHE_TTL: The number of seconds Diffy will reuse
+    # the instances it found in an Auto Scaling Group before describing it again.
+    'DIFFY_AWS_AUTO_SCALING_CACHE_TTL': 300,
+    # DIFFY_AWS_SSM_MAX_WORKERS: The number of concurrent requests Diffy will
+    # make while polling SSM for command results.
+    'DIFFY_AWS_SSM_MAX_WORKERS': 8,
+    # DIFFY_AWS_SSM_REQUESTS_PER_SECOND: The maximum rate at which Diffy will
+    # query SSM for command results, shared across all polling workers.
+    'DIFFY_AWS_SSM_REQUESTS_PER_SECOND': 10,
+    # DIFFY_AWS_SSM_POLL_TIMEOUT: The number of seconds Diffy will wait for SSM
+    # commands to complete before reporting them as timed out.
+    'DIFFY_AWS_SSM_POLL_TIMEOUT': 3600,
     # DIFFY_PAYLOAD_LOCAL_COMMANDS: A set of raw commands that Diffy will send
     # to the local host, if local collection is specified.
     'DIFFY_PAYLOAD_LOCAL_COMMANDS': [
         'osqueryi --json "SELECT address, port, name, pid, cmdline FROM listening_ports, processes USING (pid) WHERE protocol = 6 and family = 2 AND address NOT LIKE \'127.0.0.%\'"',
         'osqueryi --json "SELECT * FROM crontab"'
         ],
+    # DIFFY_LOCAL_COLLECTION_WORKERS: The number of payload commands the local
+    # shell collection plugin will run concurrently.
+    'DIFFY_LOCAL_COLLECTION_WORKERS': 4,
+    # DIFFY_LOCAL_COLLECTION_TIMEOUT: The number of seconds a single local
+    # payload command may run before it is abandoned.
+    'DIFFY_LOCAL_COLLECTION_TIMEOUT': 300,
+    # DIFFY_CLUSTER_OUTLIER_THRESHOLD: The number of median absolute
+    # deviations an instance's cluster score may sit above the fleet median
+    # before it is flagged as anomalous.
+    'DIFFY_CLUSTER_OUTLIER_THRESHOLD': 3.0,
+    # DIFFY_CONSENSUS_THRESHOLD: The percentage of the fleet below which a row
+    # is reported as rare by the consensus analysis plugin.
+    'DIFFY_CONSENSUS_THRESHOLD': 10.0,
     # DIFFY_PAYLOAD_OSQUERY_KEY: An AWS S3 key prefix describing the download
     # location of your osquery binary.
     'DIFFY_PAYLOAD_OSQUERY_KEY': 'osquery-download',
@@ -230,6 +284,22 @@ DEFAULTS: Dict[str, Union[Iterable[Any], Path, str, bool, None]] = {
         'osqueryi --json "SELECT * FROM crontab"',
         "osqueryi --json \"SELECT address, port, name, pid, cmdline FROM listening_ports, processes USING (pid) WHERE protocol = 6 and family = 2 AND address NOT LIKE '127.0.0.%'\"",
     ],
+    # DIFFY_ANALYSIS_INCLUDE_STDOUT: Whether the analysis document keeps each
+    # instance's full collection output alongside its diff. Per instance
+    # results are always persisted on their own, so disabling this keeps
+    # memory bounded by the instances in flight rather than the fleet size.
+    "DIFFY_ANALYSIS_INCLUDE_STDOUT": True,
+    # DIFFY_ANALYSIS_SKIP_UNCHANGED: Whether instances whose collection output
+    # hashes the same as in the previous analysis, or as the baseline, reuse
+    # that result instead of being diffed again. Previous results are only
+    # reused when made by the same analysis plugin with the same options.
+    "DIFFY_ANALYSIS_SKIP_UNCHANGED": False,
+    # DIFFY_ANALYSIS_PERSIST_UNCHANGED: Whether per instance results are
+    # rewritten for instances skipped as unchanged.
+    "DIFFY_ANALYSIS_PERSIST_UNCHANGED": True,
+    # DIFFY_PERSISTENCE_BATCH_SIZE: The number of per instance results handed
+    # to the persistence plugin at once during an analysis.
+    "DIFFY_PERSISTENCE_BATCH_SIZE": 50,
     # DIFFY_PERSISTENCE_PLUGIN: The default plugin to use to save Diffy
     # results.
     "DIFFY_PERSISTENCE_PLUGIN": "local-file",
@@ -251,6 +321,26 @@ DEFAULTS: Dict[str, Union[Iterable[Any], Path, str, bool, None]] = {
     "SWAG_BUCKET_NAME": None,
     # SWAG_DATA_FILE: Name of the file containing SWAG data.
     "SWAG_DATA_FILE": "v2/accounts.json",
+    # DIFFY_CLI_CACHE_DIRECTORY: Where the CLI caches the options it generates
+    # from plugin schemas. The cache is rebuilt whenever the installed plugins
+    # change. Set to an empty value to always regenerate them.
+    "DIFFY_CLI_CACHE_DIRECTORY": os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.join("~", ".cache")), "diffy"
+    ),
+    # DIFFY_API_FAN_OUT_CHUNK_SIZE: When set, analyses queued through the API
+    # are split into a job per this many targets so they spread across the
+    # worker pool, with a final job assembling the analysis. Only applies to
+    # analysis plugins that look at each instance on its own.
+    "DIFFY_API_FAN_OUT_CHUNK_SIZE": None,
+    # DIFFY_API_CACHE_SIZE: The number of baseline and analysis documents the
+    # API keeps serialised in memory. Entries are keyed by the version of the
+    # stored document, so a newer save is never served from the cache.
+    "DIFFY_API_CACHE_SIZE": 128,
+    # DIFFY_API_PAGE_SIZE: The number of summaries returned per page when
+    # listing baselines or analyses through the API, unless a limit is given.
+    "DIFFY_API_PAGE_SIZE": 50,
+    # DIFFY_API_MAX_PAGE_SIZE: The largest page size the API will accept.
+    "DIFFY_API_MAX_PAGE_SIZE": 1000,
     # RQ_REDIS_URL: URL of the Redis queue utilized for Diffy dispatch.
     "RQ_REDIS_URL": None,
     # LOG_FILE: An output file for Diffy API logs.
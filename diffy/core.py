@@ -6,52 +6,294 @@
 .. moduleauthor:: Kevin Glisson <kglisson@netflix.com>
 """
 import logging
+from collections import defaultdict
+from typing import Callable, Optional
+
+from diffy.config import CONFIG
+from diffy.common.utils import command_hash, content_hash, get_row_hashes, options_hash
+from diffy.exceptions import BadArguments
 
 logger = logging.getLogger(__name__)
 
 
-def analysis(
+# fields stored with a baseline for analysis's own use, left out of what is shown
+INTERNAL_FIELDS = ("row_hashes",)
+
+
+def strip_internal_fields(item):
+    """Drops the fields kept for analysis's own use from a document, or each of its items."""
+    if isinstance(item, list):
+        return [strip_internal_fields(i) for i in item]
+    if isinstance(item, dict):
+        return {k: v for k, v in item.items() if k not in INTERNAL_FIELDS}
+    return item
+
+
+def summarize(item: dict) -> dict:
+    """Returns the part of an instance result kept in the analysis document."""
+    if CONFIG.get("DIFFY_ANALYSIS_INCLUDE_STDOUT"):
+        return item
+    return {k: v for k, v in item.items() if k != "stdout"}
+
+
+def get_previous_results(target_key: str, persistence_plugin: dict) -> dict:
+    """Fetches the results of the last analysis of a target, by instance and command."""
+    if not CONFIG.get("DIFFY_ANALYSIS_SKIP_UNCHANGED"):
+        return {}
+
+    previous = persistence_plugin["plugin"].get(
+        "analysis", target_key, **persistence_plugin["options"]
+    )
+    return {
+        (i["instance_id"], i.get("command_hash")): i
+        for i in previous or []
+        if i.get("content_hash")
+    }
+
+
+def get_baselines(target_key: str, persistence_plugin: dict) -> dict:
+    """Fetches the stored baselines of a target, by command hash.
+
+    Baselines saved before they were kept per command only hold the output of the
+    last command, so they can not be compared against and are left out.
+    """
+    stored = persistence_plugin["plugin"].get(
+        "baseline", target_key, **persistence_plugin["options"]
+    )
+    if not stored:
+        return {}
+
+    if isinstance(stored, dict):
+        stored = [stored]
+
+    baselines = {}
+    for b in stored:
+        if not b.get("command_hash"):
+            logger.warning(
+                f"Ignoring baseline saved before baselines were kept per command, re-baseline to analyze. TargetKey: {target_key}"
+            )
+            continue
+
+        b["content_hash"] = b.get("content_hash") or content_hash(b.get("stdout"))
+        baselines[b.get("command_hash")] = b
+    return baselines
+
+
+def set_command_hash(item: dict, commands: list, command_id) -> dict:
+    """Gives a result the hash of the command it came from, when its collection plugin did not.
+
+    A command id that indexes into the commands is taken as the command the result came
+    from, any other id as a run of all of the commands together.
+    """
+    if not item.get("command_hash"):
+        if isinstance(command_id, int) and 0 <= command_id < len(commands):
+            item["command_hash"] = command_hash(commands[command_id])
+        else:
+            item["command_hash"] = command_hash(commands)
+    return item
+
+
+def get_baseline(baselines: dict, item: dict) -> Optional[dict]:
+    """Finds the baseline an item should be compared against."""
+    return baselines.get(item.get("command_hash"))
+
+
+def get_result_key(target_key: str, item: dict) -> str:
+    """Creates the key an instance result is persisted under, one per instance and command."""
+    if item.get("command_hash"):
+        return f"{target_key}-{item['instance_id']}-{item['command_hash']}"
+    return f"{target_key}-{item['instance_id']}"
+
+
+def get_analysis_fingerprint(analysis_plugin: dict) -> dict:
+    """Identifies the analysis plugin and the options it was given that shape its diffs.
+
+    Only options declared by the plugin's schema are considered, so run specific
+    arguments such as the incident id do not prevent results from being reused.
+    """
+    plugin = analysis_plugin["plugin"]
+    declared = getattr(plugin._schema, "_declared_fields", {})
+    options = {k: v for k, v in analysis_plugin["options"].items() if k in declared}
+    return {"analysis_slug": plugin.slug, "analysis_options_hash": options_hash(options)}
+
+
+def get_unchanged_diff(item: dict, previous: dict, baseline_hash: str):
+    """Returns the diff to reuse for an item whose output has not changed, if any.
+
+    An item is unchanged when its output matches the baseline, or matches the
+    previous analysis made against the same baseline by the same analysis plugin
+    with the same options.
+    """
+    if not CONFIG.get("DIFFY_ANALYSIS_SKIP_UNCHANGED"):
+        return
+
+    if baseline_hash and item["content_hash"] == baseline_hash:
+        return {}
+
+    last = previous.get((item["instance_id"], item.get("command_hash")))
+    if not last:
+        return
+
+    keys = ("content_hash", "baseline_hash", "analysis_slug", "analysis_options_hash")
+    if all(last.get(k) == item.get(k) for k in keys):
+        return last.get("diff")
+
+
+def get_targets(target_key: str, target_plugin: dict, **kwargs) -> list:
+    """Resolves a target key to the instances to collect from."""
+    logger.debug(f'Attempting to collect targets with {target_plugin}. TargetKey: {target_key}')
+    target_plugin['options'].update(kwargs)
+    return target_plugin['plugin'].get(target_key, **target_plugin['options'])
+
+
+def report(progress: Optional[Callable], **counts) -> None:
+    """Hands progress counters to the caller's callback, if one was given."""
+    if progress:
+        progress(**counts)
+
+
+def analyze_targets(
     target_key: str,
-    target_plugin: dict,
+    targets: list,
     payload_plugin: dict,
     collection_plugin: dict,
     persistence_plugin: dict,
     analysis_plugin: dict,
+    progress: Callable = None,
     **kwargs,
-) -> dict:
-    """Creates a new analysis."""
-    logger.debug(f'Attempting to collect targets with {target_plugin}. TargetKey: {target_key}')
-    target_plugin['options'].update(kwargs)
-    targets = target_plugin['plugin'].get(target_key, **target_plugin['options'])
+) -> list:
+    """Collects from and analyzes the given targets, persisting each instance result.
+
+    :param progress: Called with the number of instances `targeted`, `collected`, `diffed`
+        and `persisted` as each step advances.
+    :returns: The summaries of the analyzed instance results.
+    """
+    report(progress, targeted=len(targets))
 
     logger.debug(f'Generating payload with {payload_plugin}')
     payload_plugin['options'].update(kwargs)
     commands = payload_plugin['plugin'].generate(None, **kwargs)
 
+    persistence_plugin["options"].update(kwargs)
+    batch_size = int(CONFIG.get("DIFFY_PERSISTENCE_BATCH_SIZE"))
+
+    requires_baseline = analysis_plugin["plugin"].requires_baseline
+
+    baselines = {}
+    if requires_baseline:
+        baselines = get_baselines(target_key, persistence_plugin)
+
+        if not baselines:
+            raise BadArguments(f"Cannot run analysis. No baseline found. TargetKey: {target_key}")
+
     logger.debug(f'Attempting to collect data from targets with {collection_plugin}. NumberTargets: {len(targets)}')
     collection_plugin['options'].update(kwargs)
-    results = collection_plugin['plugin'].get(targets, commands, **collection_plugin['options'])
+    analysis_plugin["options"].update(kwargs)
 
-    logger.debug(f'Persisting result data with {persistence_plugin}.')
+    if analysis_plugin["plugin"].incremental:
+        # analyze and persist each result as soon as it is collected, only a summary is kept around
+        logger.debug(f'Streaming results through analysis and persistence with {persistence_plugin}.')
+        previous = get_previous_results(target_key, persistence_plugin)
+        fingerprint = get_analysis_fingerprint(analysis_plugin)
 
-    # TODO how does this work for non-local analysis?
-    items = []
-    for k, v in results.items():
-        for i in v:
-            instance_id = i["instance_id"]
-            key = f"{target_key}-{instance_id}"
+        # work shared by every item compared to the same baseline, by command hash
+        prepared = {}
 
-            items.append(i)
-            persistence_plugin["plugin"].save(None, key, i)
+        results = []
+        batch = {}
+        for k, i in collection_plugin['plugin'].stream(targets, commands, **collection_plugin['options']):
+            report(progress, collected=1)
 
-    logger.debug('Running analysis.')
+            set_command_hash(i, commands, k)
+            baseline_item = get_baseline(baselines, i)
+            if requires_baseline and not baseline_item:
+                logger.warning(f"Skipping result, no baseline for its command. InstanceId: {i['instance_id']} CommandHash: {i.get('command_hash')}")
+                continue
 
-    results = analysis_plugin["plugin"].run(
-        items,
-        baseline=persistence_plugin["plugin"].get("baseline", target_key),
-        syntax="compact",
-    )
+            i["content_hash"] = content_hash(i.get("stdout"))
+            i["baseline_hash"] = baseline_item["content_hash"] if baseline_item else None
+            i.update(fingerprint)
+
+            unchanged = get_unchanged_diff(i, previous, i["baseline_hash"])
+            if unchanged is not None:
+                logger.debug(f"Skipping analysis of unchanged instance. InstanceId: {i['instance_id']}")
+                i["diff"] = unchanged
+                i["unchanged"] = True
+            else:
+                command = i.get("command_hash")
+                if command not in prepared:
+                    prepared[command] = analysis_plugin["plugin"].prepare(
+                        baseline_item, **analysis_plugin["options"]
+                    )
+
+                i = analysis_plugin["plugin"].analyze(
+                    i,
+                    baseline=baseline_item,
+                    syntax="compact",
+                    **analysis_plugin["options"],
+                    **prepared[command],
+                )
+                i["unchanged"] = False
+
+            results.append(summarize(i))
+            report(progress, diffed=1)
+
+            if i["unchanged"] and not CONFIG.get("DIFFY_ANALYSIS_PERSIST_UNCHANGED"):
+                continue
+
+            batch[get_result_key(target_key, i)] = i
+
+            if len(batch) >= batch_size:
+                persistence_plugin["plugin"].save_many(None, batch, **persistence_plugin["options"])
+                report(progress, persisted=len(batch))
+                batch = {}
+
+        if batch:
+            persistence_plugin["plugin"].save_many(None, batch, **persistence_plugin["options"])
+            report(progress, persisted=len(batch))
+    else:
+        results = collection_plugin['plugin'].get(targets, commands, **collection_plugin['options'])
+
+        logger.debug(f'Persisting result data with {persistence_plugin}.')
+
+        # TODO how does this work for non-local analysis?
+        items = defaultdict(list)
+        batch = {}
+        for k, v in results.items():
+            for i in v:
+                set_command_hash(i, commands, k)
+                items[i.get("command_hash")].append(i)
+                batch[get_result_key(target_key, i)] = i
+
+        report(progress, collected=len(batch))
+        persistence_plugin["plugin"].save_many(None, batch, **persistence_plugin["options"])
+        report(progress, persisted=len(batch))
+
+        logger.debug('Running analysis.')
+
+        # each command's output is only ever compared with output of the same command
+        results = []
+        for command, command_items in items.items():
+            baseline_item = get_baseline(baselines, command_items[0])
+            if requires_baseline and not baseline_item:
+                logger.warning(f"Skipping command, no baseline found for it. CommandHash: {command}")
+                continue
+
+            results.extend(
+                summarize(i) for i in analysis_plugin["plugin"].run(
+                    command_items,
+                    baseline=baseline_item,
+                    syntax="compact",
+                    **analysis_plugin["options"],
+                )
+            )
+            report(progress, diffed=len(command_items))
 
+    return results
+
+
+def save_analysis(target_key: str, results: list, persistence_plugin: dict, **kwargs) -> dict:
+    """Persists the analysis document of a target."""
     persistence_plugin["options"].update(kwargs)
     persistence_plugin["plugin"].save(
         "analysis", target_key, results, **persistence_plugin["options"]
@@ -59,6 +301,31 @@ def analysis(
     return {"analysis": results}
 
 
+def analysis(
+    target_key: str,
+    target_plugin: dict,
+    payload_plugin: dict,
+    collection_plugin: dict,
+    persistence_plugin: dict,
+    analysis_plugin: dict,
+    progress: Callable = None,
+    **kwargs,
+) -> dict:
+    """Creates a new analysis."""
+    targets = get_targets(target_key, target_plugin, **kwargs)
+    results = analyze_targets(
+        target_key,
+        targets,
+        payload_plugin,
+        collection_plugin,
+        persistence_plugin,
+        analysis_plugin,
+        progress=progress,
+        **kwargs,
+    )
+    return save_analysis(target_key, results, persistence_plugin, **kwargs)
+
+
 def baseline(
     target_key: str,
     target_plugin: dict,
@@ -88,11 +355,21 @@ def baseline(
     logger.debug("Persisting result data")
 
     baselines = []
+    items = []
     for k, v in results.items():
-        persistence_plugin["options"].update(kwargs)
-        persistence_plugin["plugin"].save(
-            "baseline", target_key, v[0], **persistence_plugin["options"]
-        )  # only one baseline
-        baselines.append({target_key: v[0]})
+        set_command_hash(v[0], commands, k)
+
+        # store the row hashes with the baseline so analysis does not have to recompute them per instance
+        v[0]["row_hashes"] = get_row_hashes(v[0])
+        v[0]["content_hash"] = content_hash(v[0].get("stdout"))
+
+        items.append(v[0])  # only one baseline per command
+        baselines.append({target_key: strip_internal_fields(v[0])})
+
+    # every command's baseline is kept together, told apart by the command hash
+    persistence_plugin["options"].update(kwargs)
+    persistence_plugin["plugin"].save(
+        "baseline", target_key, items, **persistence_plugin["options"]
+    )
 
     return {"baselines": baselines}
@@ -5,6 +5,7 @@
 
 .. moduleauthor:: Kevin Glisson (kglisson@netflix.com)
 """
+import sys
 import logging
 from diffy.common.managers import InstanceManager
 
@@ -14,6 +15,15 @@ logger = logging.getLogger(__name__)
 
 # inspired by https://github.com/getsentry/sentry
 class PluginManager(InstanceManager):
+    def __init__(self, class_list=None, instances=True):
+        # entry point names, used to guess which plugins to import first when looking up a slug
+        self.names = {}
+        # imported plugins by slug, then by (version, type), so lookups never scan the registry
+        self.index = {}
+        self.indexed = {}
+        self.ordered = None
+        super(PluginManager, self).__init__(class_list, instances)
+
     def __iter__(self):
         return iter(self.all())
 
@@ -21,9 +31,11 @@ class PluginManager(InstanceManager):
         return sum(1 for i in self.all())
 
     def all(self, version=1, plugin_type=None):
-        for plugin in sorted(
-            super(PluginManager, self).all(), key=lambda x: x.get_title()
-        ):
+        loaded = super(PluginManager, self).all()
+        if self.ordered is None or self.ordered[0] is not loaded:
+            self.ordered = (loaded, sorted(loaded, key=lambda x: x.get_title()))
+
+        for plugin in self.ordered[1]:
             if not plugin.type == plugin_type and plugin_type:
                 continue
             if not plugin.is_enabled():
@@ -32,16 +44,104 @@ class PluginManager(InstanceManager):
                 continue
             yield plugin
 
-    def get(self, slug):
-        for plugin in self.all(version=1):
-            if plugin.slug == slug:
-                return plugin
-        for plugin in self.all(version=2):
-            if plugin.slug == slug:
+    def update(self, class_list):
+        self.index = {}
+        self.indexed = {}
+        super(PluginManager, self).update(class_list)
+
+    def load(self, class_path):
+        if class_path in self.loaded:
+            return self.loaded[class_path]
+
+        plugin = super(PluginManager, self).load(class_path)
+        if plugin is not None and getattr(plugin, "slug", None):
+            key = (plugin.__version__, plugin.type)
+            self.index.setdefault(plugin.slug, {}).setdefault(key, plugin)
+            self.indexed[class_path] = (plugin.slug, key)
+        return plugin
+
+    def remove(self, class_path):
+        slug, key = self.indexed.pop(class_path, (None, None))
+        if slug is not None:
+            entries = self.index[slug]
+            if entries.get(key) is self.loaded.get(class_path):
+                del entries[key]
+                # another registered class may provide the same slug
+                for other, indexed in self.indexed.items():
+                    if indexed == (slug, key):
+                        entries[key] = self.loaded[other]
+                        break
+            if not entries:
+                del self.index[slug]
+        super(PluginManager, self).remove(class_path)
+
+    def find(self, slug, plugin_type=None):
+        """Looks up an enabled, already imported plugin by slug, preferring version 1."""
+        entries = self.index.get(slug)
+        if not entries:
+            return None
+
+        fallback = None
+        for (version, type), plugin in entries.items():
+            if plugin_type and type != plugin_type:
+                continue
+            if not plugin.is_enabled():
+                continue
+            if version == 1:
                 return plugin
-        logger.error(
-            f"Unable to find slug: {slug} in self.all version 1: {self.all(version=1)} or version 2: {self.all(version=2)}"
-        )
+            if version == 2 and not fallback:
+                fallback = plugin
+        return fallback
+
+    def get_lookup_order(self, slug):
+        """
+        Orders the registered plugins by how cheaply and how likely they resolve a slug:
+        already imported plugins first, then those whose module is imported, then by how
+        many words their entry point name shares with the slug.
+        """
+        words = set(slug.split("-"))
+
+        def rank(class_path):
+            module_name = class_path.rsplit(".", 1)[0]
+            name = self.names.get(class_path, "")
+            return (
+                not self.is_loaded(class_path),
+                module_name not in sys.modules,
+                -len(words.intersection(name.split("_"))),
+            )
+
+        return sorted(self.get_class_list(), key=rank)
+
+    def get(self, slug, plugin_type=None):
+        """
+        Finds an enabled plugin by slug, and optionally type, preferring version 1 plugins.
+
+        Imported plugins are looked up in the index; registered plugins that have not
+        been imported yet are imported one at a time until the slug is found.
+        """
+        plugin = self.find(slug, plugin_type)
+        if plugin and plugin.__version__ == 1:
+            return plugin
+
+        if len(self.loaded) == len(self.class_list):
+            pending = []
+        else:
+            pending = self.get_lookup_order(slug)
+
+        for class_path in pending:
+            if self.is_loaded(class_path):
+                continue
+
+            loaded = self.load(class_path)
+            if loaded and loaded.slug == slug:
+                plugin = self.find(slug, plugin_type)
+                if plugin and plugin.__version__ == 1:
+                    return plugin
+
+        if plugin:
+            return plugin
+
+        logger.error(f"Unable to find slug: {slug} in plugins: {sorted(self.index)}")
         raise KeyError(slug)
 
     def first(self, func_name, *args, **kwargs):
@@ -67,6 +167,11 @@ class PluginManager(InstanceManager):
         self.add("%s.%s" % (cls.__module__, cls.__name__))
         return cls
 
+    def register_entry_point(self, name, class_path):
+        """Registers a plugin advertised by an installed package, without importing it."""
+        self.names[class_path] = name
+        self.add(class_path)
+
     def unregister(self, cls):
         self.remove("%s.%s" % (cls.__module__, cls.__name__))
         return cls
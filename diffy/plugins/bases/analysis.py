@@ -13,5 +13,21 @@ class AnalysisPlugin(Plugin):
     type = "analysis"
     _schema = PluginOptionSchema
 
+    # whether a stored baseline must be fetched before running
+    requires_baseline = True
+
+    # whether items can be analyzed one at a time, as they are collected
+    incremental = False
+
+    def prepare(self, baseline=None, **kwargs):
+        """Does the work shared by every item compared to a baseline, once.
+
+        Returns extra arguments handed to :meth:`analyze` along with each item.
+        """
+        return {}
+
     def run(self, items, **kwargs):
         raise NotImplementedError
+
+    def analyze(self, item, **kwargs):
+        raise NotImplementedError
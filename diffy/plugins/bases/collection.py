@@ -14,4 +14,20 @@ class CollectionPlugin(Plugin):
     _schema = PluginOptionSchema
 
     def get(self, targets, incident, commands, **kwargs):
+        """Returns a dict of command id to the results collected for it.
+
+        Each result should carry a `command_hash` telling the commands it ran apart.
+        Results without one are given the hash of the command their id indexes, or of
+        all the commands when the id is not an index.
+        """
         raise NotImplementedError
+
+    def stream(self, targets, commands, **kwargs):
+        """Yields (command_id, result) tuples as results become available.
+
+        Plugins able to hand back results before collection has finished should
+        override this, by default it waits for ``get`` to complete.
+        """
+        for command_id, results in self.get(targets, commands, **kwargs).items():
+            for result in results:
+                yield command_id, result
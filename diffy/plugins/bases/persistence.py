@@ -19,5 +19,24 @@ class PersistencePlugin(Plugin):
     def get_all(self, **kwargs):
         raise NotImplementedError
 
+    def list(self, file_type, limit=None, cursor=None, **kwargs):
+        """Returns a page of summaries for stored items of the given type.
+
+        Summaries carry `key`, `file_type`, `collected_at` and `instances`. The page
+        is returned as ``{'total': ..., 'items': [...], 'cursor': ...}`` where
+        `cursor` is passed back to fetch the next page, and is ``None`` on the last one.
+        """
+        raise NotImplementedError
+
+    def get_version(self, file_type, key, **kwargs):
+        """Returns an opaque token that changes whenever the stored item does, or ``None``
+        if the item does not exist or the plugin cannot tell cheaply."""
+        return None
+
     def save(self, file_type, key, item, **kwargs):
         raise NotImplementedError
+
+    def save_many(self, file_type, items, **kwargs):
+        """Saves a dict of key to item. Plugins able to write in bulk should override this."""
+        for key, item in items.items():
+            self.save(file_type, key, item, **kwargs)
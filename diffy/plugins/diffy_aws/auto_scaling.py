@@ -7,15 +7,23 @@
 .. moduleauthor:: Kevin Glisson <kglisson@netflix.com>
 """
 import logging
-from typing import List
+import threading
+import time
+from typing import Dict, List, Optional
 
 from retrying import retry
 from botocore.exceptions import ClientError
 
+from diffy.config import CONFIG
 from .sts import sts_client
 
 logger = logging.getLogger(__name__)
 
+# the most group names the Auto Scaling API accepts in a single describe call
+MAX_GROUP_NAMES = 50
+# the most groups the Auto Scaling API returns in a single page
+MAX_RECORDS = 100
+
 
 def retry_throttled(exception):
     """
@@ -30,16 +38,124 @@ def retry_throttled(exception):
     return False
 
 
-@sts_client("autoscaling")
 @retry(
     retry_on_exception=retry_throttled,
     stop_max_attempt_number=7,
     wait_exponential_multiplier=1000,
 )
-def describe_auto_scaling_group(group_name: str, **kwargs) -> List[str]:
-    """Uses boto to query for command status."""
-    logger.debug(f"Describing autoscaling group. AutoScalingGroupName: {group_name}")
+def describe_page(client, **params) -> dict:
+    """Fetches a single page of auto scaling groups, retrying when throttled."""
+    return client.describe_auto_scaling_groups(**params)
+
+
+@sts_client("autoscaling")
+def describe_auto_scaling_groups(
+    group_names: List[str] = None, filters: List[dict] = None, **kwargs
+) -> List[dict]:
+    """Describes the named groups, or the groups matching the filters.
+
+    Names are sent in batches of up to 50 per call and each batch is paged through.
+    """
+    if group_names is not None:
+        batches = [
+            {"AutoScalingGroupNames": group_names[i : i + MAX_GROUP_NAMES]}
+            for i in range(0, len(group_names), MAX_GROUP_NAMES)
+        ]
+    else:
+        batches = [{"Filters": filters or []}]
+
+    groups = []
+    for params in batches:
+        params["MaxRecords"] = MAX_RECORDS
+        while True:
+            logger.debug(f"Describing autoscaling groups. Params: {params}")
+            response = describe_page(kwargs["client"], **params)
+            groups.extend(response["AutoScalingGroups"])
+
+            if not response.get("NextToken"):
+                break
+            params["NextToken"] = response["NextToken"]
+
+    return groups
+
+
+def describe_auto_scaling_group(group_name: str, **kwargs) -> List[dict]:
+    """Describes a single auto scaling group."""
+    return describe_auto_scaling_groups([group_name], **kwargs)
+
+
+class GroupCache(object):
+    """Process wide cache of the instances in each auto scaling group.
+
+    Entries are keyed by (account, region, group name), or by tag filter for group
+    lookups by tag, and expire after `DIFFY_AWS_AUTO_SCALING_CACHE_TTL` seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        """Drops all cached groups."""
+        with self.lock:
+            self.entries = {}
+
+    def get(self, key: tuple) -> Optional[object]:
+        """Returns the cached value for the key, if it has not expired."""
+        entry = self.entries.get(key)
+        if entry and time.monotonic() - entry[0] < CONFIG.get("DIFFY_AWS_AUTO_SCALING_CACHE_TTL"):
+            return entry[1]
+        return None
+
+    def set(self, key: tuple, value: object) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+
+
+cache = GroupCache()
+
+
+def get_group_instances(group_names: List[str], account_number: str, region: str) -> Dict[str, List[str]]:
+    """Maps each named group to the ids of its instances, describing only groups not cached.
+
+    Groups that do not exist are left out.
+    """
+    instances = {}
+    missing = []
+    for name in dict.fromkeys(group_names):
+        cached = cache.get((account_number, region, name))
+        if cached is None:
+            missing.append(name)
+        else:
+            instances[name] = cached
+
+    if missing:
+        groups = describe_auto_scaling_groups(missing, account_number=account_number, region=region)
+        for group in groups:
+            name = group["AutoScalingGroupName"]
+            instances[name] = [i["InstanceId"] for i in group["Instances"]]
+            cache.set((account_number, region, name), instances[name])
+
+    return {name: instances[name] for name in group_names if name in instances}
+
+
+def find_group_instances(tags: Dict[str, str], account_number: str, region: str) -> Dict[str, List[str]]:
+    """Maps every group carrying all of the given tags to the ids of its instances."""
+    key = (account_number, region, "tags", tuple(sorted(tags.items())))
+    instances = cache.get(key)
+    if instances is not None:
+        return instances
+
+    filters = [{"Name": f"tag:{k}", "Values": [v]} for k, v in sorted(tags.items())]
+    groups = describe_auto_scaling_groups(
+        filters=filters, account_number=account_number, region=region
+    )
+
+    instances = {}
+    for group in groups:
+        name = group["AutoScalingGroupName"]
+        instances[name] = [i["InstanceId"] for i in group["Instances"]]
+        cache.set((account_number, region, name), instances[name])
 
-    return kwargs["client"].describe_auto_scaling_groups(
-        AutoScalingGroupNames=[group_name]
-    )["AutoScalingGroups"]
+    cache.set(key, instances)
+    return instances
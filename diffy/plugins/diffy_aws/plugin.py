@@ -6,10 +6,13 @@
 .. moduleauthor:: Kevin Glisson <kglisson@netflix.com>
 """
 import logging
-from typing import List
+import threading
+import time
+from typing import List, Optional
 
 import boto3
-from botocore.exceptions import ClientError, NoCredentialsError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 from marshmallow import fields
 
 from diffy.config import CONFIG
@@ -18,30 +21,80 @@ from diffy.schema import DiffyInputSchema
 from diffy.plugins import diffy_aws as aws
 from diffy.plugins.bases import PersistencePlugin, TargetPlugin, CollectionPlugin
 
-from .s3 import save_file, load_file
-from .ssm import process
-from .auto_scaling import describe_auto_scaling_group
+from diffy.common.utils import decode_cursor, encode_cursor
+
+from .s3 import save_file, save_files, load_file, load_files, list_files, get_file_etag, get_s3_key, get_s3_prefix
+from .ssm import process, process_iter
+from .auto_scaling import find_group_instances, get_group_instances
 
 
 logger = logging.getLogger(__name__)
 
 
-def get_default_aws_account_number() -> dict:
-    """Retrieves current account number"""
-    sts = boto3.client('sts')
-    accountId = '1234'
+# used when the account can not be determined
+FALLBACK_ACCOUNT_NUMBER = "1234"
+
+_account_number = None
+_account_failed_at = None
+_account_lock = threading.Lock()
+
+
+def get_default_aws_account_number() -> str:
+    """Retrieves the current account number, looking it up at most once per process.
+
+    A failed lookup falls back to the default account and is retried once
+    `DIFFY_AWS_IDENTITY_RETRY_INTERVAL` seconds have passed.
+    """
+    global _account_number, _account_failed_at
+
+    if CONFIG.get("DIFFY_AWS_ACCOUNT_NUMBER"):
+        return CONFIG["DIFFY_AWS_ACCOUNT_NUMBER"]
+
+    if CONFIG.get("DIFFY_AWS_OFFLINE"):
+        return FALLBACK_ACCOUNT_NUMBER
+
+    with _account_lock:
+        if _account_number is not None:
+            return _account_number
+
+        retry_interval = float(CONFIG.get("DIFFY_AWS_IDENTITY_RETRY_INTERVAL"))
+        if _account_failed_at is not None and time.monotonic() - _account_failed_at < retry_interval:
+            return FALLBACK_ACCOUNT_NUMBER
+
+        account_number = get_caller_account_number()
+        if account_number is None:
+            _account_failed_at = time.monotonic()
+            return FALLBACK_ACCOUNT_NUMBER
+
+        _account_number = account_number
+        return _account_number
+
+
+def get_caller_account_number() -> Optional[str]:
+    """Looks up the account of the current credentials, giving up quickly when AWS is unreachable.
+
+    :returns: The account number, or None when the lookup failed.
+    """
+    timeout = float(CONFIG.get("DIFFY_AWS_IDENTITY_TIMEOUT"))
+    config = Config(connect_timeout=timeout, read_timeout=timeout, retries={"max_attempts": 0})
     try:
-        accountId = sts.get_caller_identity()['Account']
-    except (ClientError, NoCredentialsError) as e:
-        logger.debug(f'Failed to get AWS AccountID, using Prod: {e}')
-    return accountId
+        return boto3.client("sts", config=config).get_caller_identity()["Account"]
+    except (BotoCoreError, ClientError) as e:
+        logger.debug(f"Failed to get AWS AccountID, using Prod: {e}")
+        return None
 
 
+def get_aws_options(**kwargs) -> dict:
+    """Resolves the account and region to operate in, falling back to the defaults."""
+    return {
+        "account_number": kwargs.get("account_number") or get_default_aws_account_number(),
+        "region": kwargs.get("region") or CONFIG["DIFFY_DEFAULT_REGION"],
+    }
+
 
 class AWSSchema(DiffyInputSchema):
-    account_number = fields.String(
-        default=get_default_aws_account_number, missing=get_default_aws_account_number
-    )
+    # no default, so that commands which never reach AWS do not look the account up
+    account_number = fields.String(missing=get_default_aws_account_number)
     region = fields.String(
         default=CONFIG["DIFFY_DEFAULT_REGION"], missing=CONFIG["DIFFY_DEFAULT_REGION"]
     )
@@ -56,20 +109,80 @@ class S3PersistencePlugin(PersistencePlugin):
     author = "Kevin Glisson"
     author_url = "https://github.com/netflix/diffy.git"
 
-    def get(self, key: str, **kwargs) -> dict:
+    def get(self, file_type: str, key: str, **kwargs) -> dict:
         """Fetches a result from S3."""
-        logger.debug(f"Retrieving file from S3. Bucket: {self.bucket_name} Key: {key}")
-        return load_file(key)
-
-    # TODO
-    def get_all(self, **kwargs):
-        """Fetches all results from S3."""
-        pass
+        logger.debug(f"Retrieving file from S3. FileType: {file_type} Key: {key}")
+        return load_file(get_s3_key(file_type, key), **get_aws_options(**kwargs))
+
+    def get_all(self, file_type: str, **kwargs) -> List[dict]:
+        """Fetches all results of the given type from S3."""
+        options = get_aws_options(**kwargs)
+        objects = list_files(get_s3_prefix(file_type), **options)
+        return load_files([o["Key"] for o in objects], **options)
+
+    def list(self, file_type: str, limit: int = None, cursor: str = None, **kwargs) -> dict:
+        """Lists a page of results of the given type from object metadata alone."""
+        prefix = get_s3_prefix(file_type)
+        objects = list_files(
+            prefix, limit=limit, start_after=decode_cursor(cursor), **get_aws_options(**kwargs)
+        )
 
-    def save(self, key: str, item: str, **kwargs) -> dict:
+        items = []
+        for o in objects:
+            items.append(
+                {
+                    "key": o["Key"][len(prefix) : -len(".json")],
+                    "file_type": file_type,
+                    "size": o["Size"],
+                    "collected_at": o["LastModified"].isoformat(),
+                    "instances": None,
+                }
+            )
+
+        next_cursor = None
+        if limit and len(objects) == limit:
+            next_cursor = encode_cursor(objects[-1]["Key"])
+
+        # counting every object would mean listing the whole prefix
+        return {"total": None, "items": items, "cursor": next_cursor}
+
+    def get_version(self, file_type: str, key: str, **kwargs) -> Optional[str]:
+        """Uses the ETag of the S3 object as its version."""
+        return get_file_etag(get_s3_key(file_type, key), **get_aws_options(**kwargs))
+
+    def save(self, file_type: str, key: str, item: dict, **kwargs) -> dict:
         """Saves a result to S3."""
-        logger.debug(f"Saving file to S3. Bucket: {self.bucket_name} Item: {item}")
-        return save_file(key, item)
+        logger.debug(f"Saving file to S3. FileType: {file_type} Key: {key}")
+        return save_file(
+            get_s3_key(file_type, key),
+            item,
+            dry_run=kwargs.get("dry_run"),
+            **get_aws_options(**kwargs),
+        )
+
+    def save_many(self, file_type: str, items: dict, **kwargs) -> None:
+        """Saves many results to S3 with concurrent uploads."""
+        logger.debug(f"Saving files to S3. FileType: {file_type} Items: {len(items)}")
+        save_files(
+            {get_s3_key(file_type, k): v for k, v in items.items()},
+            dry_run=kwargs.get("dry_run"),
+            **get_aws_options(**kwargs),
+        )
+
+
+def parse_group_key(key: str) -> tuple:
+    """Splits an auto scaling target key into group names and tag filters."""
+    names, tags = [], {}
+    for part in key.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if part.startswith("tag:"):
+            tag, _, value = part[len("tag:"):].partition("=")
+            tags[tag] = value
+        else:
+            names.append(part)
+    return names, tags
 
 
 class AutoScalingTargetPlugin(TargetPlugin):
@@ -86,17 +199,28 @@ class AutoScalingTargetPlugin(TargetPlugin):
     _schema = AWSSchema
 
     def get(self, key: str, **kwargs) -> List[str]:
-        """Fetches instances to target for collection."""
-        logger.debug(f"Fetching instances for Auto Scaling Group. GroupName: {key}")
-        groups = describe_auto_scaling_group(
-            key, account_number=kwargs["account_number"], region=kwargs["region"]
-        )
-        logger.debug(groups)
+        """Fetches instances to target for collection.
+
+        The key is a comma separated list of group names and `tag:<key>=<value>` filters;
+        groups matching all of the tag filters are targeted along with the named groups.
+        """
+        names, tags = parse_group_key(key)
+        logger.debug(f"Fetching instances for Auto Scaling Groups. GroupNames: {names} Tags: {tags}")
+
+        options = get_aws_options(**kwargs)
+        groups = get_group_instances(names, **options) if names else {}
+        if tags:
+            groups.update(find_group_instances(tags, **options))
+
+        missing = [n for n in names if n not in groups]
+        if missing:
+            logger.warning(f"Auto Scaling Groups not found. GroupNames: {missing}")
 
         if not groups:
             raise TargetNotFound(target_key=key, plugin_slug=self.slug, **kwargs)
 
-        return [x["InstanceId"] for x in groups[0]["Instances"]]
+        instances = [i for group in groups.values() for i in group]
+        return list(dict.fromkeys(instances))
 
 
 class SSMCollectionPlugin(CollectionPlugin):
@@ -117,6 +241,15 @@ class SSMCollectionPlugin(CollectionPlugin):
             targets,
             commands,
             incident_id=kwargs["incident_id"],
-            account_number=kwargs["account_number"],
-            region=kwargs["region"],
+            **get_aws_options(**kwargs),
+        )
+
+    def stream(self, targets: List[str], commands: List[str], **kwargs):
+        """Queries an target via SSM, yielding each instance result as it completes."""
+        logger.debug(f"Streaming instances. Instances: {targets}")
+        return process_iter(
+            targets,
+            commands,
+            incident_id=kwargs["incident_id"],
+            **get_aws_options(**kwargs),
         )
@@ -5,10 +5,18 @@
     :license: Apache, see LICENSE for more details.
 .. moduleauthor:: Kevin Glisson <kglisson@netflix.com>
 """
+import io
+import os
 import json
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Tuple
 
 from retrying import retry
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 
 from .sts import sts_client
@@ -18,13 +26,116 @@ from diffy.config import CONFIG
 logger = logging.getLogger(__name__)
 
 
+def get_s3_key(file_type: str, key: str) -> str:
+    """Creates the S3 object key for a given result."""
+    if file_type:
+        return f"{file_type}/{key}.json"
+    return f"{key}.json"
+
+
+def get_s3_prefix(file_type: str) -> str:
+    """Creates the S3 key prefix under which results of a given type are stored."""
+    return f"{file_type}/" if file_type else ""
+
+
+class ObjectCache(object):
+    """Read through LRU cache of S3 documents keyed by object key, validated by ETag.
+
+    Documents are cached as their serialized JSON body, so every reader parses its own copy
+    and callers changing a document never change what is cached. Entries are kept in memory
+    and, when DIFFY_AWS_S3_CACHE_DIRECTORY is set, on disk so they survive between runs.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get_path(self, key: str) -> Optional[str]:
+        directory = CONFIG.get("DIFFY_AWS_S3_CACHE_DIRECTORY")
+        if directory:
+            name = hashlib.sha1(key.encode("utf-8")).hexdigest()  # nosec: not used for security
+            return os.path.join(directory, f"{name}.json")
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        """Returns the cached (etag, body) for a key, if any."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        path = self.get_path(key)
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    entry = json.load(f)
+                etag, body = entry["etag"], entry["body"]
+            except (IOError, ValueError, KeyError):
+                return
+            self.put(key, etag, body, persist=False)
+            return etag, body
+
+    def put(self, key: str, etag: str, body: str, persist: bool = True) -> None:
+        """Caches the serialized body of a document along with the ETag it was read or written with."""
+        with self.lock:
+            self.entries[key] = (etag, body)
+            self.entries.move_to_end(key)
+            while len(self.entries) > int(CONFIG.get("DIFFY_AWS_S3_CACHE_SIZE")):
+                self.entries.popitem(last=False)
+
+        path = self.get_path(key)
+        if path and persist:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump({"etag": etag, "body": body}, f)
+
+    def invalidate(self, key: str) -> None:
+        """Drops any cached copy of a key."""
+        with self.lock:
+            self.entries.pop(key, None)
+
+        path = self.get_path(key)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+cache = ObjectCache()
+
+
+def get_error_code(exception: Exception) -> Optional[str]:
+    if isinstance(exception, ClientError):
+        return exception.response["Error"]["Code"]
+
+
+def is_not_modified(exception: Exception) -> bool:
+    """Determines if the exception is S3 answering a conditional GET with 304."""
+    return get_error_code(exception) in ("304", "NotModified")
+
+
+def is_missing(exception: Exception) -> bool:
+    """Determines if the exception is due to the object not existing."""
+    return get_error_code(exception) in ("404", "NoSuchKey")
+
+
+def retry_s3_error(exception: Exception) -> bool:
+    """Retries everything except answers that will not change on a second attempt."""
+    return not (is_not_modified(exception) or is_missing(exception))
+
+
 @retry(
+    retry_on_exception=retry_s3_error,
     stop_max_attempt_number=3,
     wait_exponential_multiplier=1000,
     wait_exponential_max=10000,
 )
-def _get_from_s3(client, bucket, data_file):
-    return client.get_object(Bucket=bucket, Key=data_file)["Body"].read()
+def _get_from_s3(client, bucket, data_file, etag=None):
+    params = dict(Bucket=bucket, Key=data_file)
+    if etag:
+        params["IfNoneMatch"] = etag
+    return client.get_object(**params)
 
 
 @retry(
@@ -43,27 +154,128 @@ def _put_to_s3(client, bucket, data_file, body):
 
 
 @sts_client("s3")
-def load_file(key: str, **kwargs) -> dict:
-    """Tries to load JSON data from S3."""
+def load_file(key: str, **kwargs) -> Optional[dict]:
+    """Tries to load JSON data from S3, revalidating any cached copy with its ETag."""
     bucket = CONFIG.get("DIFFY_AWS_PERSISTENCE_BUCKET")
     logger.debug(f"Loading item from s3. Bucket: {bucket} Key: {key}")
+
+    cached = cache.get(key)
     try:
-        data = _get_from_s3(kwargs["client"], bucket, key)
+        response = _get_from_s3(kwargs["client"], bucket, key, etag=cached[0] if cached else None)
+    except ClientError as e:
+        if cached and is_not_modified(e):
+            logger.debug(f"Item not modified, using cached copy. Key: {key}")
+            return json.loads(cached[1])
 
-        data = data.decode("utf-8")
+        if is_missing(e):
+            cache.invalidate(key)
+            return
 
-        return json.loads(data)
-    except ClientError as e:
         logger.exception(e)
-    assert False
+        raise
+
+    body = response["Body"].read().decode("utf-8")
+    cache.put(key, response["ETag"], body)
+    return json.loads(body)
 
 
 @sts_client("s3")
-def save_file(key: str, item: str, dry_run=None, **kwargs) -> dict:
+def save_file(key: str, item: Any, dry_run=None, **kwargs) -> dict:
     """Tries to write JSON data to data file in S3."""
     bucket = CONFIG.get("DIFFY_AWS_PERSISTENCE_BUCKET")
     logger.debug(f"Writing item to s3. Bucket: {bucket} Key: {key}")
 
     if not dry_run:
-        return _put_to_s3(kwargs["client"], bucket, key, item)
+        body = json.dumps(item)
+        response = _put_to_s3(kwargs["client"], bucket, key, body)
+        cache.put(key, response["ETag"], body)
+        return response
     return {}
+
+
+@sts_client("s3")
+def get_file_etag(key: str, **kwargs) -> Optional[str]:
+    """Fetches the ETag of an object without reading it."""
+    bucket = CONFIG.get("DIFFY_AWS_PERSISTENCE_BUCKET")
+
+    try:
+        return kwargs["client"].head_object(Bucket=bucket, Key=key)["ETag"]
+    except ClientError as e:
+        if is_missing(e):
+            return
+        raise
+
+
+@sts_client("s3")
+def list_files(prefix: str, limit: int = None, start_after: str = None, **kwargs) -> List[dict]:
+    """Lists the objects under a prefix, following pagination, without reading them."""
+    bucket = CONFIG.get("DIFFY_AWS_PERSISTENCE_BUCKET")
+    logger.debug(f"Listing items in s3. Bucket: {bucket} Prefix: {prefix}")
+
+    params = dict(Bucket=bucket, Prefix=prefix)
+    if start_after:
+        params["StartAfter"] = start_after
+
+    objects = []
+    while True:
+        if limit:
+            params["MaxKeys"] = min(1000, limit - len(objects))
+
+        response = kwargs["client"].list_objects_v2(**params)
+        objects += response.get("Contents", [])
+
+        if not response.get("IsTruncated") or (limit and len(objects) >= limit):
+            return objects
+        params["ContinuationToken"] = response["NextContinuationToken"]
+
+
+@sts_client("s3")
+def load_files(keys: List[str], **kwargs) -> List[dict]:
+    """Loads JSON data for many keys from S3 concurrently, preserving order."""
+    bucket = CONFIG.get("DIFFY_AWS_PERSISTENCE_BUCKET")
+    logger.debug(f"Loading items from s3. Bucket: {bucket} Keys: {len(keys)}")
+
+    def load(key):
+        return json.loads(_get_from_s3(kwargs["client"], bucket, key)["Body"].read().decode("utf-8"))
+
+    with ThreadPoolExecutor(max_workers=int(CONFIG.get("DIFFY_AWS_S3_MAX_WORKERS"))) as executor:
+        return list(executor.map(load, keys))
+
+
+@sts_client("s3")
+def save_files(items: dict, dry_run=None, **kwargs) -> None:
+    """Writes many JSON documents to S3 concurrently, uploading large ones in parts.
+
+    :param items: Dict of S3 key to JSON serializable document.
+    """
+    bucket = CONFIG.get("DIFFY_AWS_PERSISTENCE_BUCKET")
+    logger.debug(f"Writing items to s3. Bucket: {bucket} Items: {len(items)}")
+
+    if dry_run:
+        return
+
+    max_workers = int(CONFIG.get("DIFFY_AWS_S3_MAX_WORKERS"))
+    config = TransferConfig(
+        multipart_threshold=int(CONFIG.get("DIFFY_AWS_S3_MULTIPART_THRESHOLD")),
+        max_concurrency=max_workers,
+    )
+
+    def upload(entry):
+        key, item = entry
+        body = io.BytesIO(json.dumps(item).encode("utf-8"))
+        kwargs["client"].upload_fileobj(
+            body,
+            bucket,
+            key,
+            ExtraArgs={
+                "ContentType": "application/json",
+                "CacheControl": "no-cache, no-store, must-revalidate",
+            },
+            Config=config,
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(upload, items.items()))
+
+    for key in items.keys():
+        cache.invalidate(key)
@@ -7,22 +7,27 @@
 .. moduleauthor:: Kevin Glisson <kglisson@netflix.com>
 """
 import json
+import time
 import logging
 from base64 import urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple
 
 from botocore.exceptions import ClientError
 
 from retrying import retry
 
+from diffy.config import CONFIG
 from diffy.filters import AWSFilter
-from diffy.exceptions import PendingException
-from diffy.common.utils import chunk
+from diffy.common.utils import chunk, command_hash, RateLimiter
 from .sts import sts_client
 
 logger = logging.getLogger(__name__)
 logger.addFilter(AWSFilter())
 
+# list_command_invocations truncates plugin output to this many characters
+MAX_INVOCATION_OUTPUT = 2500
+
 
 # TODO process all commands
 def encode_command(string: str) -> str:
@@ -68,20 +73,37 @@ def send_commands(
     return response["Command"]["CommandId"], response["Command"]["Status"]
 
 
-def process(instances: List[str], commands: List[str], **kwargs) -> dict:
-    """Dispatch an SSM command to each instance in a list."""
+def send(instances: List[str], commands: List[str], **kwargs) -> dict:
+    """Dispatch an SSM command to each instance in a list, without waiting for results."""
     # boto limits us to 50 per
     command_ids = {}
+
+    # the commands run as a single script, so they share one baseline
+    commands_hash = command_hash(commands)
     for c in chunk(instances, 50):
         logger.debug(
             f"Sending command. Instances: {c} Command: {json.dumps(commands, indent=2)}"
         )
         command_id, status = send_commands(c, commands, **kwargs)
         command_ids[command_id] = [
-            {"instance_id": i, "status": status, "stdout": ""} for i in c
+            {"instance_id": i, "status": status, "stdout": "", "command_hash": commands_hash}
+            for i in c
         ]
 
-    return poll(command_ids, **kwargs)
+    return command_ids
+
+
+def process(instances: List[str], commands: List[str], **kwargs) -> dict:
+    """Dispatch an SSM command to each instance in a list."""
+    return poll(send(instances, commands, **kwargs), **kwargs)
+
+
+def process_iter(instances: List[str], commands: List[str], **kwargs):
+    """Dispatch an SSM command to each instance in a list, yielding results as they complete.
+
+    Results are not retained once yielded.
+    """
+    yield from iter_poll(get_pending(send(instances, commands, **kwargs)), **kwargs)
 
 
 def retry_throttled(exception) -> bool:
@@ -114,6 +136,27 @@ def get_command_invocation(command_id: str, instance_id: str, **kwargs) -> dict:
     )
 
 
+@sts_client("ssm")
+@retry(
+    retry_on_exception=retry_throttled,
+    stop_max_attempt_number=7,
+    wait_exponential_multiplier=1000,
+)
+def list_command_invocations(command_id: str, **kwargs) -> List[dict]:
+    """Uses boto to query for the status of every invocation of a command, 50 at a time."""
+    logger.debug(f"Listing command invocations. CommandId: {command_id}")
+
+    invocations = []
+    params = dict(CommandId=command_id, Details=True, MaxResults=50)
+    while True:
+        response = kwargs["client"].list_command_invocations(**params)
+        invocations += response["CommandInvocations"]
+
+        if not response.get("NextToken"):
+            return invocations
+        params["NextToken"] = response["NextToken"]
+
+
 def is_completed(status: str) -> bool:
     """Determines if the status is deemed to be completed."""
     if status in ["Success", "TimedOut", "Cancelled", "Failed"]:
@@ -121,13 +164,116 @@ def is_completed(status: str) -> bool:
     return False
 
 
-def retry_pending(exception) -> bool:
-    """Determines if exception is due to commands stuck in pending state and retries."""
-    return isinstance(exception, PendingException)
+def get_inline_output(invocation: dict) -> dict:
+    """Builds a command invocation response from a listed invocation, if its output was not truncated."""
+    if invocation["Status"] != "Success" or len(invocation.get("CommandPlugins", [])) != 1:
+        return
+
+    plugin = invocation["CommandPlugins"][0]
+    output = plugin.get("Output", "")
+    if len(output) >= MAX_INVOCATION_OUTPUT:
+        return
+
+    finished_at = plugin.get("ResponseFinishDateTime")
+    if hasattr(finished_at, "isoformat"):
+        finished_at = finished_at.isoformat()
+
+    return {
+        "Status": invocation["Status"],
+        "ExecutionEndDateTime": finished_at,
+        "StandardOutputContent": output,
+        "StandardErrorContent": "",
+    }
+
+
+def update_result(result: dict, response: dict) -> None:
+    """Records a completed command invocation on the instance result."""
+    logger.debug(f"Command completed. Response: {json.dumps(response, indent=2, default=str)}")
+
+    result["status"] = response["Status"]
+    result["collected_at"] = response["ExecutionEndDateTime"]
+
+    if result["status"] == "Success":
+        result["stdout"] = json.loads(response["StandardOutputContent"])
+    else:
+        result["stderr"] = response["StandardErrorContent"]
+        logger.error(
+            f'Failed to fetch command output. Instance: {result["instance_id"]} Reason: {response["StandardErrorContent"]}'
+        )
+
+
+def get_pending(command_ids: dict) -> dict:
+    """Indexes instance results by command id and instance id."""
+    return {
+        cid: {i["instance_id"]: i for i in instances}
+        for cid, instances in command_ids.items()
+    }
+
+
+def iter_poll(pending: dict, **kwargs):
+    """Query the SSM endpoint until all commands have completed, yielding each result as it does.
+
+    Each round lists the invocations of every command with outstanding instances (up to 50
+    per call) and only fetches the output of invocations that have completed since the last
+    round, so finished instances are never queried again. Yielded results are removed from
+    `pending`.
+
+    :returns: Generator of (command_id, result) tuples.
+    """
+    limiter = RateLimiter(float(CONFIG.get("DIFFY_AWS_SSM_REQUESTS_PER_SECOND")))
+    deadline = time.monotonic() + float(CONFIG.get("DIFFY_AWS_SSM_POLL_TIMEOUT"))
+
+    def list_invocations(command_id):
+        limiter.wait()
+        return list_command_invocations(command_id, **kwargs)
+
+    def fetch_output(completed):
+        command_id, result, invocation = completed
+        response = get_inline_output(invocation)
+        if response:
+            return response
+
+        limiter.wait()
+        return get_command_invocation(command_id, result["instance_id"], **kwargs)
+
+    wait = 1
+    with ThreadPoolExecutor(max_workers=int(CONFIG.get("DIFFY_AWS_SSM_MAX_WORKERS"))) as executor:
+        while True:
+            active = [cid for cid, instances in pending.items() if instances]
+            if not active:
+                return
+
+            completed = []
+            for cid, invocations in zip(active, executor.map(list_invocations, active)):
+                for invocation in invocations:
+                    result = pending[cid].get(invocation["InstanceId"])
+                    if result and is_completed(invocation["Status"]):
+                        completed.append((cid, result, invocation))
+
+            for (cid, result, _), response in zip(completed, executor.map(fetch_output, completed)):
+                update_result(result, response)
+                del pending[cid][result["instance_id"]]
+                yield cid, result
+
+            remaining = sum(len(instances) for instances in pending.values())
+            if not remaining:
+                return
+
+            if time.monotonic() > deadline:
+                logger.error(f"Timed out waiting for SSM commands. Pending: {remaining}")
+                for cid, instances in pending.items():
+                    for result in list(instances.values()):
+                        result["status"] = "TimedOut"
+                        result["stderr"] = "Timed out waiting for SSM command to complete."
+                        del instances[result["instance_id"]]
+                        yield cid, result
+                return
+
+            logger.debug(f"SSM commands not yet completed. Pending: {remaining} Wait: {wait}")
+            time.sleep(wait)
+            wait = min(wait * 2, 30)
 
 
-# TODO is this the most efficient polling wise?
-@retry(retry_on_exception=retry_pending, wait_exponential_multiplier=1000)
 def poll(command_ids: dict, **kwargs) -> dict:
     """Query the SSM endpoint to determine whether a command has completed.
 
@@ -143,26 +289,7 @@ def poll(command_ids: dict, **kwargs) -> dict:
             ]
         }
     """
-    for cid, instances in command_ids.items():
-        for i in instances:
-            response = get_command_invocation(cid, i["instance_id"], **kwargs)
-
-            if not is_completed(response["Status"]):
-                raise PendingException("SSM command is not yet completed.")
-
-            logger.debug(
-                f"Command completed. Response: {json.dumps(response, indent=2)}"
-            )
-
-            i["status"] = response["Status"]
-            i["collected_at"] = response["ExecutionEndDateTime"]
-
-            if i["status"] != "Failed":
-                i["stdout"] = json.loads(response["StandardOutputContent"])
-            else:
-                i["stderr"] = response["StandardErrorContent"]
-                logger.error(
-                    f'Failed to fetch command output. Instance: {i["instance_id"]} Reason: {response["StandardErrorContent"]}'
-                )
+    for _ in iter_poll(get_pending(command_ids), **kwargs):
+        pass
 
     return command_ids
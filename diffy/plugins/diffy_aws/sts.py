@@ -6,6 +6,8 @@
 .. moduleauthor:: Kevin Glisson <kglisson@netflix.com>
 """
 import logging
+import threading
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 
 import boto3
@@ -14,42 +16,124 @@ from diffy.config import CONFIG
 
 logger = logging.getLogger(__name__)
 
+# credentials are refreshed this long before they actually expire
+REFRESH_WINDOW = timedelta(minutes=5)
 
-def sts_client(service, service_type="client"):
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            sts = boto3.client("sts")
 
-            account_number = kwargs["account_number"]
-            role = CONFIG.get("DIFFY_AWS_ASSUME_ROLE", "Diffy")
+def is_expiring(credentials: dict) -> bool:
+    """Determines if assumed role credentials are expired or about to be."""
+    expiration = credentials["Expiration"]
+    if expiration.tzinfo is None:
+        expiration = expiration.replace(tzinfo=timezone.utc)
+    return expiration - REFRESH_WINDOW <= datetime.now(timezone.utc)
 
-            arn = f"arn:aws:iam::{account_number}:role/{role}"
 
-            kwargs.pop("account_number")
+class ClientCache(object):
+    """Process wide cache of assumed role credentials and the boto clients built from them.
+
+    Clients are keyed by (account, role, region, service) and reused until their
+    credentials near expiry. Resources are not thread safe, so they are built fresh
+    on each call from the cached credentials.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self) -> None:
+        """Drops all cached credentials and clients and resets the counters."""
+        with self.lock:
+            self.credentials = {}
+            self.clients = {}
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """Returns the client cache hit and miss counters."""
+        return {"hits": self.hits, "misses": self.misses}
+
+    def get_credentials(self, account_number: str, role: str) -> dict:
+        """Returns credentials for the given role, assuming it when needed."""
+        key = (account_number, role)
+        credentials = self.credentials.get(key)
+        if credentials and not is_expiring(credentials):
+            return credentials
+
+        with self.lock:
+            # another thread may have refreshed while we waited
+            credentials = self.credentials.get(key)
+            if credentials and not is_expiring(credentials):
+                return credentials
+
+            arn = f"arn:aws:iam::{account_number}:role/{role}"
 
             # TODO add incident specific information to RoleSessionName
             logger.debug(f"Assuming role. Arn: {arn}")
-            role = sts.assume_role(RoleArn=arn, RoleSessionName="diffy")
+            sts = boto3.client("sts")
+            credentials = sts.assume_role(RoleArn=arn, RoleSessionName="diffy")["Credentials"]
+
+            self.credentials[key] = credentials
+            return credentials
+
+    def get_client(self, service: str, account_number: str, role: str, region: str):
+        """Returns a client for the given service, reusing one built from current credentials."""
+        key = (account_number, role, region, service)
+        credentials = self.get_credentials(account_number, role)
+
+        entry = self.clients.get(key)
+        if entry and entry[1] is credentials:
+            with self.lock:
+                self.hits += 1
+            return entry[0]
+
+        with self.lock:
+            self.misses += 1
+            entry = self.clients.get(key)
+            if entry and entry[1] is credentials:
+                return entry[0]
+
+            client = boto3.client(
+                service,
+                region_name=region,
+                aws_access_key_id=credentials["AccessKeyId"],
+                aws_secret_access_key=credentials["SecretAccessKey"],
+                aws_session_token=credentials["SessionToken"],
+            )
+            self.clients[key] = (client, credentials)
+            return client
+
+    def get_resource(self, service: str, account_number: str, role: str, region: str):
+        """Returns a new resource for the given service built from cached credentials."""
+        credentials = self.get_credentials(account_number, role)
+
+        with self.lock:
+            return boto3.resource(
+                service,
+                region_name=region,
+                aws_access_key_id=credentials["AccessKeyId"],
+                aws_secret_access_key=credentials["SecretAccessKey"],
+                aws_session_token=credentials["SessionToken"],
+            )
+
+
+cache = ClientCache()
+
+
+def sts_client(service, service_type="client"):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            account_number = kwargs.pop("account_number")
+            role = CONFIG.get("DIFFY_AWS_ASSUME_ROLE", "Diffy")
 
             if service_type == "client":
-                client = boto3.client(
-                    service,
-                    region_name=kwargs["region"],
-                    aws_access_key_id=role["Credentials"]["AccessKeyId"],
-                    aws_secret_access_key=role["Credentials"]["SecretAccessKey"],
-                    aws_session_token=role["Credentials"]["SessionToken"],
+                kwargs["client"] = cache.get_client(
+                    service, account_number, role, kwargs["region"]
                 )
-                kwargs["client"] = client
             elif service_type == "resource":
-                resource = boto3.resource(
-                    service,
-                    region_name=kwargs["region"],
-                    aws_access_key_id=role["Credentials"]["AccessKeyId"],
-                    aws_secret_access_key=role["Credentials"]["SecretAccessKey"],
-                    aws_session_token=role["Credentials"]["SessionToken"],
+                kwargs["resource"] = cache.get_resource(
+                    service, account_number, role, kwargs["region"]
                 )
-                kwargs["resource"] = resource
             return f(*args, **kwargs)
 
         return decorated_function
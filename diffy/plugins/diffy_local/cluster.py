@@ -0,0 +1,132 @@
+"""
+.. module: diffy.plugins.diffy_local.cluster
+    :platform: Unix
+    :copyright: (c) 2018 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+.. moduleauthor:: Kevin Glisson <kglisson@netflix.com>
+"""
+import logging
+from collections import defaultdict
+from typing import List
+
+import numpy as np
+from scipy import sparse
+
+from diffy.common.utils import get_rows, row_hash
+
+logger = logging.getLogger(__name__)
+
+# ratio of the median to the mean absolute deviation of normally distributed scores
+MEAN_DEVIATION_SCALE = 0.8453
+
+
+def build_row_matrix(instances: dict) -> tuple:
+    """Builds a sparse instance x distinct row presence matrix.
+
+    :returns: Tuple of the CSR matrix, the column index for each row hash, the representative
+        row for each column and, for each column, the position of the item within its instance
+        it was first seen in.
+    """
+    columns = {}
+    column_rows = []
+    column_positions = []
+    indices = []
+    indptr = [0]
+
+    for items in instances.values():
+        seen = set()
+        for position, item in enumerate(items):
+            for row in get_rows(item["stdout"]):
+                h = row_hash(row)
+                col = columns.get(h)
+                if col is None:
+                    col = columns[h] = len(column_rows)
+                    column_rows.append(row)
+                    column_positions.append(position)
+
+                if col not in seen:
+                    seen.add(col)
+                    indices.append(col)
+        indptr.append(len(indices))
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(indices)), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+        shape=(len(instances), len(column_rows)),
+    )
+    return matrix, columns, column_rows, column_positions
+
+
+def cluster_scores(matrix: sparse.csr_matrix) -> tuple:
+    """Scores each instance by its rarity weighted Jaccard distance from the fleet consensus.
+
+    Rows present on at least half of the fleet make up the consensus, rarer rows weigh more.
+
+    :returns: Tuple of the per instance scores and the consensus column mask.
+    """
+    frequency = np.asarray(matrix.sum(axis=0)).ravel() / max(matrix.shape[0], 1)
+    consensus = frequency >= 0.5
+    weights = np.log1p(1.0 / np.maximum(frequency, 1e-12))
+
+    intersection = matrix @ (weights * consensus)
+    union = matrix @ weights + weights[consensus].sum() - intersection
+
+    similarity = np.divide(intersection, union, out=np.ones_like(union), where=union > 0)
+    return 1.0 - similarity, consensus
+
+
+def find_outliers(scores: np.ndarray, threshold: float) -> np.ndarray:
+    """Flags scores sitting more than `threshold` median absolute deviations above the median.
+
+    When the median absolute deviation is zero the scaled mean absolute deviation is used
+    instead, and when every score is the same nothing is flagged.
+    """
+    if not len(scores):
+        return np.zeros(0, dtype=bool)
+
+    median = np.median(scores)
+    spread = np.median(np.abs(scores - median))
+    if spread == 0:
+        # more than half the fleet shares a score, fall back to the mean absolute
+        # deviation, scaled to be comparable with the median absolute deviation
+        spread = MEAN_DEVIATION_SCALE * np.mean(np.abs(scores - median))
+        if spread == 0:
+            return np.zeros(len(scores), dtype=bool)
+
+    return scores > median + threshold * spread + 1e-9
+
+
+def cluster_items(items: List[dict], threshold: float) -> List[dict]:
+    """Scores each instance against the fleet and diffs the outliers against the consensus."""
+    instances = defaultdict(list)
+    for i in items:
+        instances[i["instance_id"]].append(i)
+
+    matrix, columns, column_rows, column_positions = build_row_matrix(instances)
+    scores, consensus = cluster_scores(matrix)
+    outliers = find_outliers(scores, threshold)
+    consensus_columns = np.flatnonzero(consensus)
+
+    logger.debug(f"Cluster analysis complete. Instances: {matrix.shape[0]} Rows: {matrix.shape[1]} Outliers: {outliers.sum()}")
+
+    for idx, instance_items in enumerate(instances.values()):
+        missing = []
+        if outliers[idx]:
+            missing = np.setdiff1d(consensus_columns, matrix[idx].indices, assume_unique=True)
+
+        for position, i in enumerate(instance_items):
+            i["score"] = float(scores[idx])
+            i["diff"] = {}
+
+            if not outliers[idx]:
+                continue
+
+            added = [r for r in get_rows(i["stdout"]) if not consensus[columns[row_hash(r)]]]
+            removed = [column_rows[c] for c in missing if column_positions[c] == position]
+
+            i["diff"]["score"] = i["score"]
+            if added:
+                i["diff"]["added"] = added
+            if removed:
+                i["diff"]["removed"] = removed
+
+    return items
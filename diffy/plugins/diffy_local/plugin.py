@@ -11,13 +11,19 @@ import shlex
 import datetime
 import json
 import logging
-from typing import List
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
 
 from jsondiff import diff
+from marshmallow import fields
 
 from diffy.config import CONFIG
+from diffy.common.utils import command_hash, decode_cursor, encode_cursor, get_row_hashes, get_rows, row_hash
 from diffy.exceptions import BadArguments
+from diffy.schema import DiffyInputSchema
 from diffy.plugins import diffy_local as local
+from diffy.plugins.diffy_local.storage import list_index, pack, unpack, update_index
 from diffy.plugins.bases import AnalysisPlugin, PersistencePlugin, PayloadPlugin, CollectionPlugin, TargetPlugin
 
 
@@ -34,6 +40,130 @@ def get_local_file_path(file_type: str, key: str) -> str:
     return os.path.join(CONFIG.get("DIFFY_LOCAL_FILE_DIRECTORY"), file_name)
 
 
+def run_command(cmd: str, timeout: int = None) -> dict:
+    """Runs a single payload command on the local system."""
+    logger.debug(f'Querying local system with: {cmd}')
+    # format command which is a string with an osqueryi shell command into a list of args for subprocess
+    formatted_cmd = shlex.split(cmd)
+
+    try:
+        process_result = subprocess.run(formatted_cmd, stdout=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.error(f'Local command timed out. Timeout: {timeout} Command: {cmd}')
+        return {
+            'instance_id': 'localhost',
+            'status': 'TimedOut',
+            'collected_at': datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+            'stdout': '',
+            'stderr': f'Command did not complete within {timeout} seconds.'
+        }
+
+    stdout = process_result.stdout.decode('utf-8')
+
+    # TODO: check return status and pass stderr if needed
+    return {
+        'instance_id': 'localhost',
+        'status': 'success',
+        'collected_at': datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+        'stdout': json.loads(stdout)
+    }
+
+
+def get_key_columns(key_columns: Optional[str]) -> List[str]:
+    """Splits a comma separated list of key columns."""
+    if not key_columns:
+        return []
+    if isinstance(key_columns, str):
+        key_columns = key_columns.split(",")
+    return [c.strip() for c in key_columns if c.strip()]
+
+
+def group_rows(rows: List[dict], columns: List[str] = None, hashes: List[str] = None) -> dict:
+    """Groups rows by their key hash, keeping the full row hash alongside each row.
+
+    :param hashes: Precomputed full row hashes, in the same order as the rows.
+    """
+    if hashes is None or len(hashes) != len(rows):
+        hashes = [row_hash(r) for r in rows]
+
+    groups = defaultdict(list)
+    for full_hash, row in zip(hashes, rows):
+        key = row_hash(row, columns) if columns else full_hash
+        groups[key].append((full_hash, row))
+    return groups
+
+
+def row_diff(baseline_rows, rows: List[dict], columns: List[str] = None) -> dict:
+    """Calculates the added, removed and changed rows between two osquery results.
+
+    Rows are matched on the hash of their key columns (or of the whole row when no
+    columns are given) so the comparison is linear in the number of rows.
+
+    :param baseline_rows: The baseline rows, or the result of :func:`group_rows` on them.
+    """
+    expected = baseline_rows if isinstance(baseline_rows, dict) else group_rows(baseline_rows, columns)
+    observed = group_rows(rows, columns)
+
+    added, removed, changed = [], [], []
+    for key, current in observed.items():
+        previous = expected.get(key)
+        if not previous:
+            added.extend(r for _, r in current)
+            continue
+
+        previous_rows = dict(previous)
+        current_rows = dict(current)
+        previous_counts = Counter(h for h, _ in previous)
+        current_counts = Counter(h for h, _ in current)
+
+        gone = [previous_rows[h] for h, n in (previous_counts - current_counts).items() for _ in range(n)]
+        new = [current_rows[h] for h, n in (current_counts - previous_counts).items() for _ in range(n)]
+
+        for b, c in zip(gone, new):
+            changed.append({"baseline": b, "current": c})
+
+        added.extend(new[len(gone):])
+        removed.extend(gone[len(new):])
+
+    for key, previous in expected.items():
+        if key not in observed:
+            removed.extend(r for _, r in previous)
+
+    result = {}
+    if added:
+        result["added"] = added
+    if removed:
+        result["removed"] = removed
+    if changed:
+        result["changed"] = changed
+    return result
+
+
+class RowAnalysisSchema(DiffyInputSchema):
+    key_columns = fields.String(missing=None)
+
+
+class ConsensusAnalysisSchema(DiffyInputSchema):
+    consensus_threshold = fields.Float(
+        default=CONFIG["DIFFY_CONSENSUS_THRESHOLD"], missing=CONFIG["DIFFY_CONSENSUS_THRESHOLD"]
+    )
+
+
+class ClusterAnalysisSchema(DiffyInputSchema):
+    outlier_threshold = fields.Float(
+        default=CONFIG["DIFFY_CLUSTER_OUTLIER_THRESHOLD"], missing=CONFIG["DIFFY_CLUSTER_OUTLIER_THRESHOLD"]
+    )
+
+
+class LocalShellCollectionSchema(DiffyInputSchema):
+    max_workers = fields.Integer(
+        default=CONFIG["DIFFY_LOCAL_COLLECTION_WORKERS"], missing=CONFIG["DIFFY_LOCAL_COLLECTION_WORKERS"]
+    )
+    command_timeout = fields.Integer(
+        default=CONFIG["DIFFY_LOCAL_COLLECTION_TIMEOUT"], missing=CONFIG["DIFFY_LOCAL_COLLECTION_TIMEOUT"]
+    )
+
+
 class SimpleAnalysisPlugin(AnalysisPlugin):
     title = "simple"
     slug = "local-simple"
@@ -43,17 +173,71 @@ class SimpleAnalysisPlugin(AnalysisPlugin):
     author = "Kevin Glisson"
     author_url = "https://github.com/Netflix-Skunkworks/diffy.git"
 
+    incremental = True
+
     def run(self, items: List[dict], **kwargs) -> List[dict]:
         """Run simple difference calculation on results based on a baseline."""
         logger.debug("Performing simple local baseline analysis.")
+        return [self.analyze(i, **kwargs) for i in items]
 
+    def analyze(self, item: dict, **kwargs) -> dict:
+        """Run simple difference calculation on a single result based on a baseline."""
         if not kwargs.get("baseline"):
             raise BadArguments("Cannot run simple analysis. No baseline found.")
 
-        for i in items:
-            i["diff"] = diff(kwargs["baseline"]["stdout"], i["stdout"])
+        baseline = kwargs["baseline"]
 
-        return items
+        # identical output needs no structural diff, which is far more expensive than hashing
+        if get_row_hashes(baseline) == get_row_hashes(item):
+            item["diff"] = {}
+        else:
+            item["diff"] = diff(baseline["stdout"], item["stdout"])
+        return item
+
+
+class RowAnalysisPlugin(AnalysisPlugin):
+    title = "row"
+    slug = "local-row"
+    description = "Perform row based set difference analysis on collection results."
+    version = local.__version__
+
+    author = "Kevin Glisson"
+    author_url = "https://github.com/Netflix-Skunkworks/diffy.git"
+
+    _schema = RowAnalysisSchema
+
+    incremental = True
+
+    def prepare(self, baseline: dict = None, **kwargs) -> dict:
+        """Groups the baseline rows once, for every instance compared to it."""
+        if not baseline:
+            return {}
+
+        columns = get_key_columns(kwargs.get("key_columns"))
+        groups = group_rows(get_rows(baseline["stdout"]), columns, get_row_hashes(baseline))
+        return {"baseline_groups": groups}
+
+    def run(self, items: List[dict], **kwargs) -> List[dict]:
+        """Run row based difference calculation on results based on a baseline."""
+        logger.debug("Performing row based local baseline analysis.")
+        kwargs.update(self.prepare(**kwargs))
+        return [self.analyze(i, **kwargs) for i in items]
+
+    def analyze(self, item: dict, **kwargs) -> dict:
+        """Run row based difference calculation on a single result based on a baseline.
+
+        :param baseline_groups: The baseline as grouped by :meth:`prepare`, grouped here when not given.
+        """
+        if not kwargs.get("baseline"):
+            raise BadArguments("Cannot run row analysis. No baseline found.")
+
+        expected = kwargs.get("baseline_groups")
+        if expected is None:
+            expected = self.prepare(**kwargs)["baseline_groups"]
+
+        columns = get_key_columns(kwargs.get("key_columns"))
+        item["diff"] = row_diff(expected, get_rows(item["stdout"]), columns)
+        return item
 
 
 class ClusterAnalysisPlugin(AnalysisPlugin):
@@ -65,9 +249,66 @@ class ClusterAnalysisPlugin(AnalysisPlugin):
     author = "Kevin Glisson"
     author_url = "https://github.com/Netflix-Skunkworks/diffy.git"
 
+    _schema = ClusterAnalysisSchema
+    requires_baseline = False
+
     def run(self, items: List[dict], **kwargs) -> List[dict]:
-        """Run cluster calculation on results based on a baseline."""
+        """Run cluster calculation on results, flagging instances that stand out from the fleet."""
         logger.debug("Performing simple local cluster analysis.")
+        # numpy and scipy are slow to import, so only load them when clustering
+        from diffy.plugins.diffy_local.cluster import cluster_items
+
+        threshold = kwargs.get("outlier_threshold")
+        if threshold is None:
+            threshold = CONFIG.get("DIFFY_CLUSTER_OUTLIER_THRESHOLD")
+
+        return cluster_items(items, float(threshold))
+
+
+class ConsensusAnalysisPlugin(AnalysisPlugin):
+    title = "consensus"
+    slug = "local-consensus"
+    description = "Report rows seen on only a small share of the fleet, without a baseline."
+    version = local.__version__
+
+    author = "Kevin Glisson"
+    author_url = "https://github.com/Netflix-Skunkworks/diffy.git"
+
+    _schema = ConsensusAnalysisSchema
+    requires_baseline = False
+
+    def run(self, items: List[dict], **kwargs) -> List[dict]:
+        """Run consensus calculation on results using a fleet wide row frequency index."""
+        logger.debug("Performing local fleet consensus analysis.")
+        threshold = kwargs.get("consensus_threshold")
+        if threshold is None:
+            threshold = CONFIG.get("DIFFY_CONSENSUS_THRESHOLD")
+        threshold = float(threshold)
+
+        # each row is counted once per instance, regardless of how many items it shows up in
+        frequency = Counter()
+        instances = defaultdict(set)
+        hashes = []
+        for i in items:
+            item_hashes = [row_hash(r) for r in get_rows(i["stdout"])]
+            hashes.append(item_hashes)
+            instances[i["instance_id"]].update(item_hashes)
+
+        for instance_hashes in instances.values():
+            frequency.update(instance_hashes)
+
+        total = len(instances)
+        logger.debug(f"Built row frequency index. Instances: {total} Rows: {len(frequency)}")
+
+        for i, item_hashes in zip(items, hashes):
+            rare = []
+            for row, h in zip(get_rows(i["stdout"]), item_hashes):
+                share = frequency[h] / total
+                if share * 100 < threshold:
+                    rare.append({"row": row, "frequency": share})
+
+            i["diff"] = {"rare": rare} if rare else {}
+
         return items
 
 
@@ -87,28 +328,47 @@ class FilePersistencePlugin(PersistencePlugin):
 
         if os.path.exists(path):
             with open(path, "r") as f:
-                return json.load(f)
+                return unpack(json.load(f))
 
-    def get_all(self, file_type: str) -> List[dict]:
-        """Fetches all files matching given prefix"""
-        path = os.path.join(CONFIG.get("DIFFY_LOCAL_FILE_DIRECTORY"))
+    def get_version(self, file_type: str, key: str, **kwargs) -> Optional[str]:
+        """Uses the modification time and size of the local file as its version."""
+        try:
+            stat = os.stat(get_local_file_path(file_type, key))
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
 
+    def get_all(self, file_type: str) -> List[dict]:
+        """Fetches all files of the given type."""
         items = []
-        for p in [os.path.abspath(x) for x in os.listdir(path)]:
-            file = p.split("/")[-1]
-            if file.startswith(file_type) and file.endswith(".json"):
-                with open(p, "r") as f:
-                    items.append(json.load(f))
+        for entry in list_index(file_type)["items"]:
+            item = self.get(file_type, entry["key"])
+            if item is not None:
+                items.append(item)
         return items
 
+    def list(self, file_type: str, limit: int = None, cursor: str = None, **kwargs) -> dict:
+        """Lists a page of stored files of the given type from the index, without reading them."""
+        page = list_index(file_type, limit=limit, after=decode_cursor(cursor))
+
+        page["cursor"] = None
+        if limit and len(page["items"]) == limit:
+            page["cursor"] = encode_cursor(page["items"][-1]["key"])
+        return page
+
     def save(self, file_type: str, key: str, item: dict, **kwargs) -> None:
         """Save data to local file system."""
         path = get_local_file_path(file_type, key)
         logging.debug(f"Writing persistent data. Path: {path}")
 
+        if CONFIG.get("DIFFY_LOCAL_FILE_CONTENT_ADDRESSED"):
+            item = pack(item)
+
         with open(path, "w") as f:
             json.dump(item, f)
 
+        update_index(file_type, key, path, item)
+
 
 class CommandPayloadPlugin(PayloadPlugin):
     title = "command"
@@ -132,6 +392,8 @@ class LocalShellCollectionPlugin(CollectionPlugin):
     author = 'Alex Maestretti'
     author_url = 'https://github.com/Netflix-Skunkworks/diffy.git'
 
+    _schema = LocalShellCollectionSchema
+
     def get(self, targets: List[str], commands: List[str], **kwargs) -> dict:
         """Queries local system target via subprocess shell.
 
@@ -147,27 +409,30 @@ class LocalShellCollectionPlugin(CollectionPlugin):
             ]
         }
         """
-        # TODO: check if we are root, warn user if not we may not get a full baseline
         results = {}
-        for idx, cmd in enumerate(commands):
-            logger.debug(f'Querying local system with: {cmd}')
-            # format command which is a string with an osqueryi shell command into a list of args for subprocess
-            formatted_cmd = shlex.split(cmd)
-
-            # TODO support python37
-            process_result = subprocess.run(formatted_cmd, stdout=subprocess.PIPE)  # python36 only
-            stdout = process_result.stdout.decode('utf-8')
-            
-            # TODO: check return status and pass stderr if needed
-            results[idx] = [{
-                'instance_id': 'localhost',
-                'status': 'success',
-                'collected_at': datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-                'stdout': json.loads(stdout)
-            }]
-            logger.debug(f'Results[{idx}] : {format(json.dumps(stdout, indent=2))}')
+        for idx, result in sorted(self.stream(targets, commands, **kwargs), key=lambda x: x[0]):
+            results[idx] = [result]
+            logger.debug(f'Results[{idx}] : {format(json.dumps(results[idx], indent=2))}')
         return results
 
+    def stream(self, targets: List[str], commands: List[str], **kwargs):
+        """Queries local system target via subprocess shell, yielding (command index, result)
+        tuples as each command completes."""
+        # TODO: check if we are root, warn user if not we may not get a full baseline
+        max_workers = int(kwargs.get('max_workers') or CONFIG.get('DIFFY_LOCAL_COLLECTION_WORKERS'))
+        timeout = int(kwargs.get('command_timeout') or CONFIG.get('DIFFY_LOCAL_COLLECTION_TIMEOUT'))
+
+        # commands are independent of one another, so run them side by side and
+        # only wait as long as the slowest one
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {executor.submit(run_command, cmd, timeout): idx for idx, cmd in enumerate(commands)}
+
+            for future in as_completed(futures):
+                idx = futures.pop(future)
+                result = future.result()
+                result['command_hash'] = command_hash(commands[idx])
+                yield idx, result
+
 
 class LocalTargetPlugin(TargetPlugin):
     title = 'command'
@@ -0,0 +1,263 @@
+"""
+.. module: diffy.plugins.diffy_local.storage
+    :platform: Unix
+    :copyright: (c) 2018 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+.. moduleauthor:: Kevin Glisson <kglisson@netflix.com>
+"""
+import os
+import gzip
+import json
+import hashlib
+import sqlite3
+import logging
+import tempfile
+from contextlib import contextmanager
+from typing import Any
+
+from diffy.config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+# marks a collection output that has been moved out to a content addressed blob
+BLOB_REF = "$blob"
+
+
+def get_local_blob_path(digest: str) -> str:
+    """Creates the full path for a given content addressed blob."""
+    return os.path.join(
+        CONFIG.get("DIFFY_LOCAL_FILE_DIRECTORY"), "blobs", digest[:2], f"{digest}.json.gz"
+    )
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """Writes data to a temporary file and moves it into place."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def save_blob(data: Any) -> str:
+    """Stores data as a compressed blob keyed by the hash of its content, once.
+
+    :returns: The hex digest identifying the blob.
+    """
+    content = json.dumps(data, sort_keys=True).encode("utf-8")
+    digest = hashlib.sha256(content).hexdigest()
+    path = get_local_blob_path(digest)
+
+    if not os.path.exists(path):
+        logger.debug(f"Writing blob. Path: {path}")
+        atomic_write(path, gzip.compress(content))
+
+    return digest
+
+
+def load_blob(digest: str) -> Any:
+    """Loads a content addressed blob."""
+    with gzip.open(get_local_blob_path(digest), "rb") as f:
+        return json.loads(f.read().decode("utf-8"))
+
+
+def is_blob_ref(value: Any) -> bool:
+    """Determines if the value is a reference to a stored blob."""
+    return isinstance(value, dict) and list(value.keys()) == [BLOB_REF]
+
+
+def pack(item: Any) -> Any:
+    """Moves the collection output of an item, or list of items, out to blobs.
+
+    :returns: A manifest referencing the stored blobs.
+    """
+    if isinstance(item, list):
+        return [pack(i) for i in item]
+
+    if isinstance(item, dict) and item.get("stdout"):
+        manifest = dict(item)
+        manifest["stdout"] = {BLOB_REF: save_blob(item["stdout"])}
+        return manifest
+
+    return item
+
+
+def unpack(manifest: Any) -> Any:
+    """Resolves blob references in a manifest written by :func:`pack`."""
+    if isinstance(manifest, list):
+        return [unpack(i) for i in manifest]
+
+    if isinstance(manifest, dict) and is_blob_ref(manifest.get("stdout")):
+        item = dict(manifest)
+        item["stdout"] = load_blob(manifest["stdout"][BLOB_REF])
+        return item
+
+    return manifest
+
+
+INDEX_FILE = "index.db"
+KNOWN_FILE_TYPES = ("baseline", "analysis")
+
+
+def get_local_index_path() -> str:
+    """Creates the full path for the local storage index."""
+    return os.path.join(CONFIG.get("DIFFY_LOCAL_FILE_DIRECTORY"), INDEX_FILE)
+
+
+def summarize(item: Any) -> dict:
+    """Extracts the listing metadata for a stored item, or list of items."""
+    items = item if isinstance(item, list) else [item]
+    items = [i for i in items if isinstance(i, dict)]
+
+    collected_at = [str(i["collected_at"]) for i in items if i.get("collected_at")]
+    return {
+        "collected_at": max(collected_at) if collected_at else None,
+        "instances": len({i.get("instance_id") for i in items}),
+    }
+
+
+def parse_file_name(file_name: str) -> tuple:
+    """Splits a stored file name back into its file type and key."""
+    name = file_name[: -len(".json")]
+    for file_type in KNOWN_FILE_TYPES:
+        if name.startswith(f"{file_type}-"):
+            return file_type, name[len(file_type) + 1 :]
+    return None, name
+
+
+# modification time of each storage directory when its index was last reconciled
+_reconciled = {}
+
+
+@contextmanager
+def index_connection(reconcile: bool = False):
+    """Opens the local storage index.
+
+    :param reconcile: Whether to first bring the index in line with the stored files, when
+        the directory changed since it was last reconciled by this process.
+    """
+    path = get_local_index_path()
+    directory = os.path.dirname(path)
+
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS items (
+                    file_type TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    collected_at TEXT,
+                    instances INTEGER NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (file_type, key)
+                )"""
+            )
+
+        if reconcile:
+            # taken before listing, so files added while reconciling are picked up next time
+            mtime = os.stat(directory).st_mtime_ns
+            if _reconciled.get(directory) != mtime:
+                with conn:
+                    reconcile_index(conn)
+                _reconciled[directory] = mtime
+
+        yield conn
+    finally:
+        conn.close()
+
+
+def reconcile_index(conn: sqlite3.Connection) -> None:
+    """Indexes stored files that are new or changed since they were indexed, and drops
+    the entries of files that no longer exist."""
+    directory = CONFIG.get("DIFFY_LOCAL_FILE_DIRECTORY")
+    logger.debug(f"Reconciling local storage index. Directory: {directory}")
+
+    indexed = {
+        r["file_name"]: r["updated_at"]
+        for r in conn.execute("SELECT file_name, updated_at FROM items")
+    }
+
+    present = set()
+    for file_name in os.listdir(directory):
+        if not file_name.endswith(".json"):
+            continue
+
+        present.add(file_name)
+        path = os.path.join(directory, file_name)
+        if indexed.get(file_name) == os.path.getmtime(path):
+            continue
+
+        try:
+            with open(path, "r") as f:
+                item = json.load(f)
+        except (IOError, ValueError) as e:
+            logger.warning(f"Skipping unreadable file while indexing. Path: {path} Reason: {e}")
+            continue
+
+        file_type, key = parse_file_name(file_name)
+        write_index_entry(conn, file_type, key, path, item)
+
+    removed = [(f,) for f in indexed if f not in present]
+    if removed:
+        conn.executemany("DELETE FROM items WHERE file_name = ?", removed)
+
+
+def write_index_entry(conn: sqlite3.Connection, file_type: str, key: str, path: str, item: Any) -> None:
+    """Inserts or replaces the index entry for a stored file."""
+    summary = summarize(item)
+    conn.execute(
+        "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            file_type or "",
+            key,
+            os.path.basename(path),
+            os.path.getsize(path),
+            summary["collected_at"],
+            summary["instances"],
+            os.path.getmtime(path),
+        ),
+    )
+
+
+def update_index(file_type: str, key: str, path: str, item: Any) -> None:
+    """Records a freshly written file in the local storage index."""
+    with index_connection() as conn:
+        with conn:
+            write_index_entry(conn, file_type, key, path, item)
+
+
+def list_index(file_type: str, limit: int = None, after: str = None) -> dict:
+    """Lists the index entries for a file type, ordered by key.
+
+    :param limit: Maximum number of entries to return.
+    :param after: Only return entries whose key sorts after this one.
+    :returns: Dict with the matching entries under `items` and the overall count under `total`.
+    """
+    query = "SELECT * FROM items WHERE file_type = ?"
+    params = [file_type or ""]
+
+    if after is not None:
+        query += " AND key > ?"
+        params.append(after)
+
+    query += " ORDER BY key"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    with index_connection(reconcile=True) as conn:
+        total = conn.execute(
+            "SELECT COUNT(*) FROM items WHERE file_type = ?", (file_type or "",)
+        ).fetchone()[0]
+        rows = conn.execute(query, params).fetchall()
+
+    return {"total": total, "items": [dict(r, file_type=file_type) for r in rows]}
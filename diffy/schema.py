@@ -89,13 +89,11 @@ class DiffyOutputSchema(DiffySchema):
 
 def resolve_plugin_slug(slug):
     """Attempts to resolve plugin to slug."""
-    plugin = plugins.get(slug)
-
-    if not plugin:
+    try:
+        return plugins.get(slug)
+    except KeyError:
         raise ValidationError(f"Could not find plugin. Slug: {slug}")
 
-    return plugin
-
 
 class PluginOptionSchema(Schema):
     options = fields.Dict(missing={})
@@ -12,8 +12,13 @@ from diffy.plugins.base import plugins
 from diffy.exceptions import TargetNotFound
 
 from diffy_api.core import async_analysis
-from diffy_api.common.util import validate_schema
-from diffy_api.schemas import analysis_input_schema, task_output_schema
+from diffy_api.common.cache import get_document
+from diffy_api.common.util import get_document_args, get_page_args, validate_schema
+from diffy_api.schemas import (
+    analysis_input_schema,
+    summary_list_output_schema,
+    task_output_schema,
+)
 
 mod = Blueprint("analysis", __name__)
 api = Api(mod)
@@ -26,6 +31,7 @@ class AnalysisList(Resource):
         self.reqparse = reqparse.RequestParser()
         super(AnalysisList, self).__init__()
 
+    @validate_schema(None, summary_list_output_schema)
     def get(self):
         """
         .. http:get:: /analysis
@@ -33,7 +39,7 @@ class AnalysisList(Resource):
 
           **Example request**:
           .. sourcecode:: http
-             GET /analysis HTTP/1.1
+             GET /analysis?limit=2 HTTP/1.1
              Host: example.com
              Accept: application/json, text/javascript
 
@@ -43,15 +49,26 @@ class AnalysisList(Resource):
              Vary: Accept
              Content-Type: text/javascript
 
-             # TODO
+             {
+               "total": 3,
+               "items": [
+                 {"key": "asg-a", "fileType": "analysis", "collectedAt": "2018-11-30 23:15:31", "instances": 1, "size": 1024},
+                 {"key": "asg-b", "fileType": "analysis", "collectedAt": "2018-11-30 23:17:37", "instances": 1, "size": 2048}
+               ],
+               "cursor": "YXNnLWI="
+             }
+
+          :query limit: number of summaries to return
+          :query cursor: cursor returned by the previous page
 
           :statuscode 200: no error
+          :statuscode 400: the cursor is malformed
           :statuscode 403: unauthenticated
         """
-        data = plugins.get(current_app.config["DIFFY_PERSISTENCE_PLUGIN"]).get_all(
-            "analysis"
+        page = get_page_args(self.reqparse)
+        return plugins.get(current_app.config["DIFFY_PERSISTENCE_PLUGIN"]).list(
+            "analysis", **page
         )
-        return data, 200
 
     @validate_schema(analysis_input_schema, task_output_schema)
     def post(self, data=None):
@@ -86,6 +103,7 @@ class Analysis(Resource):
     """Defines the 'baselines' endpoints"""
 
     def __init__(self):
+        self.reqparse = reqparse.RequestParser()
         super(Analysis, self).__init__()
 
     def get(self, key):
@@ -107,12 +125,14 @@ class Analysis(Resource):
 
              # TODO
 
+          :query fields: top level fields to keep, e.g. `instance_id,diff`
+          :query format: `json` (default), `stream` or `ndjson`
+
           :statuscode 200: no error
+          :statuscode 304: the document matches the ETag given in If-None-Match
           :statuscode 403: unauthenticated
         """
-        plugin_slug = current_app.config["DIFFY_PERSISTENCE_PLUGIN"]
-        p = plugins.get(plugin_slug)
-        return p.get("analysis", key)
+        return get_document("analysis", key, **get_document_args(self.reqparse))
 
 
 api.add_resource(AnalysisList, "/analysis", endpoint="analysisList")
@@ -6,15 +6,16 @@
 .. moduleauthor:: Kevin Glisson <kglisson@netflix.com>
 """
 from flask import Blueprint, current_app, request
-from flask_restful import Api, Resource
+from flask_restful import reqparse, Api, Resource
 
 from diffy.plugins.base import plugins
 from diffy.exceptions import TargetNotFound
 from diffy_api.core import async_baseline
-from diffy_api.common.util import validate_schema
+from diffy_api.common.cache import get_document
+from diffy_api.common.util import get_document_args, get_page_args, validate_schema
 from diffy_api.schemas import (
     baseline_input_schema,
-    baseline_output_schema,
+    summary_list_output_schema,
     task_output_schema,
 )
 
@@ -27,9 +28,10 @@ class BaselineList(Resource):
     """Defines the 'baselines' endpoints"""
 
     def __init__(self):
+        self.reqparse = reqparse.RequestParser()
         super(BaselineList, self).__init__()
 
-    @validate_schema(None, baseline_output_schema)
+    @validate_schema(None, summary_list_output_schema)
     def get(self):
         """
         .. http:get:: /baselines
@@ -37,7 +39,7 @@ class BaselineList(Resource):
 
           **Example request**:
           .. sourcecode:: http
-             GET /baselines HTTP/1.1
+             GET /baselines?limit=2 HTTP/1.1
              Host: example.com
              Accept: application/json, text/javascript
 
@@ -47,15 +49,26 @@ class BaselineList(Resource):
              Vary: Accept
              Content-Type: text/javascript
 
-             # TODO
+             {
+               "total": 3,
+               "items": [
+                 {"key": "asg-a", "fileType": "baseline", "collectedAt": "2018-11-30 23:15:31", "instances": 1, "size": 1024},
+                 {"key": "asg-b", "fileType": "baseline", "collectedAt": "2018-11-30 23:17:37", "instances": 1, "size": 2048}
+               ],
+               "cursor": "YXNnLWI="
+             }
+
+          :query limit: number of summaries to return
+          :query cursor: cursor returned by the previous page
 
           :statuscode 200: no error
+          :statuscode 400: the cursor is malformed
           :statuscode 403: unauthenticated
         """
-        data = plugins.get(current_app.config["DIFFY_PERSISTENCE_PLUGIN"]).get_all(
-            "baseline"
+        page = get_page_args(self.reqparse)
+        return plugins.get(current_app.config["DIFFY_PERSISTENCE_PLUGIN"]).list(
+            "baseline", **page
         )
-        return data, 200
 
     @validate_schema(baseline_input_schema, task_output_schema)
     def post(self, data=None):
@@ -90,6 +103,7 @@ class Baseline(Resource):
     """Defines the 'baselines' endpoints"""
 
     def __init__(self):
+        self.reqparse = reqparse.RequestParser()
         super(Baseline, self).__init__()
 
     def get(self, key):
@@ -111,12 +125,14 @@ class Baseline(Resource):
 
              # TODO
 
+          :query fields: top level fields to keep, e.g. `instance_id,diff`
+          :query format: `json` (default), `stream` or `ndjson`
+
           :statuscode 200: no error
+          :statuscode 304: the document matches the ETag given in If-None-Match
           :statuscode 403: unauthenticated
         """
-        return plugins.get(current_app.config["DIFFY_PERSISTENCE_PLUGIN"]).get(
-            "baseline", key
-        )
+        return get_document("baseline", key, **get_document_args(self.reqparse))
 
 
 api.add_resource(Baseline, "/baselines/<key>")
@@ -0,0 +1,148 @@
+"""
+.. module: diffy_api.common.cache
+    :platform: Unix
+    :copyright: (c) 2018 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+.. moduleauthor:: Kevin Glisson <kglisson@netflix.com>
+"""
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from typing import Iterator, List
+
+from flask import current_app, request, stream_with_context
+
+from diffy.core import strip_internal_fields
+from diffy.plugins.base import plugins
+
+
+class DocumentCache(object):
+    """In process LRU of serialised documents keyed by (file type, key, version).
+
+    A save from any process changes the stored version, so entries never go stale; the
+    versions a document no longer has simply age out of the LRU.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, file_type: str, key: str, version: str):
+        with self.lock:
+            entry = self.entries.get((file_type, key, version))
+            if entry is not None:
+                self.entries.move_to_end((file_type, key, version))
+            return entry
+
+    def put(self, file_type: str, key: str, version: str, body: str, size: int) -> None:
+        with self.lock:
+            self.entries[(file_type, key, version)] = body
+            self.entries.move_to_end((file_type, key, version))
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+cache = DocumentCache()
+
+
+def get_etag(file_type: str, key: str, version: str) -> str:
+    """Derives an entity tag from the stored version, so it is known without reading the document."""
+    return hashlib.sha1(f"{file_type}:{key}:{version}".encode("utf-8")).hexdigest()  # nosec: not used for security
+
+
+def project(item, fields: List[str]):
+    """Keeps only the given top level fields of a document, or of each item of a list."""
+    if not fields:
+        return item
+    if isinstance(item, list):
+        return [project(i, fields) for i in item]
+    if isinstance(item, dict):
+        return {k: v for k, v in item.items() if k in fields}
+    return item
+
+
+def iter_json(item, fields: List[str] = None) -> Iterator[str]:
+    """Serialises a document as a JSON array one element at a time, projecting each as it goes."""
+    if not isinstance(item, list):
+        yield json.dumps(project(item, fields))
+        return
+
+    yield "["
+    for idx, i in enumerate(item):
+        yield ("," if idx else "") + json.dumps(project(i, fields))
+    yield "]"
+
+
+def iter_ndjson(item, fields: List[str] = None) -> Iterator[str]:
+    """Serialises a document as newline delimited JSON, one projected element per line."""
+    for i in item if isinstance(item, list) else [item]:
+        yield json.dumps(project(i, fields)) + "\n"
+
+
+def get_document(file_type: str, key: str, fields: List[str] = None, stream_format: str = None):
+    """Fetches a stored document for a response, answering with a 304 when the client's copy is current.
+
+    :param fields: Top level fields to keep in the document, or in each of its items.
+    :param stream_format: Streams the response as a chunked `json` array or as `ndjson`.
+
+    The persistence plugin always loads the stored document whole, so streaming does not
+    lower peak memory below the size of the document; it only avoids also holding its
+    serialised and projected copies. Only whole, unstreamed documents are cached. Documents
+    whose persistence plugin cannot report a version are never cached.
+    """
+    p = plugins.get(current_app.config["DIFFY_PERSISTENCE_PLUGIN"])
+
+    def load():
+        return strip_internal_fields(p.get(file_type, key))
+
+    version = p.get_version(file_type, key)
+    if version is None and not (fields or stream_format):
+        return load()
+
+    etag = None
+    if version is not None:
+        variant = f"{version}:{','.join(fields or [])}:{stream_format or ''}"
+        etag = get_etag(file_type, key, variant)
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+
+    if fields or stream_format:
+        item = load()
+        if item is None:
+            return None
+
+        if stream_format == "ndjson":
+            response = current_app.response_class(
+                stream_with_context(iter_ndjson(item, fields)), mimetype="application/x-ndjson"
+            )
+        elif stream_format:
+            response = current_app.response_class(
+                stream_with_context(iter_json(item, fields)), mimetype="application/json"
+            )
+        else:
+            response = current_app.response_class(json.dumps(project(item, fields)), mimetype="application/json")
+
+        if etag:
+            response.set_etag(etag)
+        return response
+
+    body = cache.get(file_type, key, version)
+    if body is None:
+        item = load()
+        if item is None:
+            return None
+
+        body = json.dumps(item)
+        cache.put(file_type, key, version, body, int(current_app.config["DIFFY_API_CACHE_SIZE"]))
+
+    response = current_app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    return response
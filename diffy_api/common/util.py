@@ -1,8 +1,13 @@
+import binascii
 from typing import List
 
 from flask import request, current_app
+from flask_restful import abort
 from functools import wraps
 from inflection import camelize
+from werkzeug.exceptions import HTTPException
+
+from diffy.common.utils import decode_cursor
 
 from diffy_api.extensions import sentry
 
@@ -41,6 +46,9 @@ def unwrap_pagination(data, output_schema):
 
             marshaled_data = {"total": data["total"]}
             marshaled_data["items"] = output_schema.dump(data["items"], many=True).data
+
+            if "cursor" in data.keys():
+                marshaled_data["cursor"] = data["cursor"]
             return marshaled_data
 
         return output_schema.dump(data).data
@@ -53,6 +61,33 @@ def unwrap_pagination(data, output_schema):
     return output_schema.dump(data).data
 
 
+def get_page_args(parser) -> dict:
+    """Parses the `limit` and `cursor` pagination query parameters."""
+    parser.add_argument("limit", type=int, location="args")
+    parser.add_argument("cursor", type=str, location="args")
+    args = parser.parse_args()
+
+    try:
+        decode_cursor(args["cursor"])
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        abort(400, message=f"Invalid cursor. Cursor: {args['cursor']}")
+
+    limit = args["limit"] or current_app.config["DIFFY_API_PAGE_SIZE"]
+    limit = max(1, min(limit, current_app.config["DIFFY_API_MAX_PAGE_SIZE"]))
+    return {"limit": limit, "cursor": args["cursor"]}
+
+
+def get_document_args(parser) -> dict:
+    """Parses the `fields` projection and `format` streaming query parameters."""
+    parser.add_argument("fields", type=str, location="args")
+    parser.add_argument("format", type=str, location="args", choices=("json", "stream", "ndjson"))
+    args = parser.parse_args()
+
+    fields = [f.strip() for f in (args["fields"] or "").split(",") if f.strip()]
+    stream_format = {"stream": "json", "ndjson": "ndjson"}.get(args["format"])
+    return {"fields": fields or None, "stream_format": stream_format}
+
+
 def validate_schema(input_schema, output_schema):
     def decorator(f):
         @wraps(f)
@@ -72,6 +107,9 @@ def validate_schema(input_schema, output_schema):
 
             try:
                 resp = f(*args, **kwargs)
+            except HTTPException:
+                # raised on purpose, e.g. by argument parsing, and already carries its status
+                raise
             except Exception as e:
                 sentry.captureException()
                 current_app.logger.exception(e)
@@ -1,8 +1,74 @@
 """Core API functions."""
-from diffy.core import baseline, analysis
+import json
+import time
+import uuid
+
+from flask import current_app
+from rq import get_current_job
+from rq.job import JobStatus
+from rq.registry import FailedJobRegistry, FinishedJobRegistry
+
+from diffy.common.utils import chunk
+from diffy.core import baseline, analysis, analyze_targets, get_baselines, get_targets, save_analysis
+from diffy.exceptions import BadArguments
 from diffy_api.extensions import rq
 from diffy_api.schemas import baseline_input_schema, analysis_input_schema
 
+# how long the bookkeeping of a fanned out analysis is kept around in redis
+FAN_OUT_KEY_TTL = 24 * 60 * 60
+
+
+# the counters tasks publish to their meta while they run
+PROGRESS_COUNTERS = ("targeted", "collected", "diffed", "persisted")
+
+
+class JobProgress(object):
+    """Publishes analysis progress counters to the meta of a job.
+
+    Counters are written back at most once per `interval` seconds, and on :meth:`flush`.
+    """
+
+    def __init__(self, job, interval: float = 1.0):
+        self.job = job
+        self.interval = interval
+        self.saved_at = 0
+
+        job.meta["progress"] = {c: 0 for c in PROGRESS_COUNTERS}
+        self.flush()
+
+    def __call__(self, **counts):
+        for k, v in counts.items():
+            self.job.meta["progress"][k] += v
+
+        if time.monotonic() - self.saved_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        self.job.save_meta()
+        self.saved_at = time.monotonic()
+
+
+def get_job_progress():
+    """Creates a progress publisher for the running job, if there is one."""
+    job = get_current_job()
+    if job:
+        return JobProgress(job)
+
+
+def get_fan_out_key(job_id: str) -> str:
+    """Creates the redis key counting the outstanding chunks of a fanned out analysis."""
+    return f"diffy:fan-out:{job_id}"
+
+
+def get_fan_out_failed_key(job_id: str) -> str:
+    """Creates the redis key collecting the chunks of a fanned out analysis that failed."""
+    return f"diffy:fan-out:{job_id}:failed"
+
+
+def get_fan_out_result_key(job_id: str, chunk_id: str) -> str:
+    """Creates the redis key holding the results of one chunk of a fanned out analysis."""
+    return f"diffy:fan-out:{job_id}:result:{chunk_id}"
+
 
 @rq.job()
 def async_baseline(kwargs):
@@ -19,4 +85,135 @@ def async_analysis(kwargs):
     # we can't pickle our objects for remote works so we pickle the raw request
     # and then load it here.
     data = analysis_input_schema.load(kwargs).data
-    return analysis(**data)
+
+    # only analyses that look at each instance on its own can be split up
+    chunk_size = current_app.config.get("DIFFY_API_FAN_OUT_CHUNK_SIZE")
+    if chunk_size and data["analysis_plugin"]["plugin"].incremental:
+        return fan_out_analysis(kwargs, data, int(chunk_size))
+
+    progress = get_job_progress()
+    try:
+        return analysis(progress=progress, **data)
+    finally:
+        if progress:
+            progress.flush()
+
+
+def fan_out_analysis(kwargs: dict, data: dict, chunk_size: int) -> dict:
+    """Splits an analysis into a job per chunk of targets.
+
+    The last chunk to finish queues a reducer which assembles the analysis document.
+    """
+    job = get_current_job()
+    persistence_plugin = data["persistence_plugin"]
+    persistence_plugin["options"].update(incident_id=data["incident_id"])
+
+    if data["analysis_plugin"]["plugin"].requires_baseline and not get_baselines(data["target_key"], persistence_plugin):
+        raise BadArguments(f"Cannot run analysis. No baseline found. TargetKey: {data['target_key']}")
+
+    targets = get_targets(data["target_key"], data["target_plugin"], incident_id=data["incident_id"])
+    chunks = list(chunk(targets, chunk_size))
+
+    # chunks publish the rest of the progress on their own jobs
+    JobProgress(job)(targeted=len(targets))
+    if not chunks:
+        return save_analysis(data["target_key"], [], persistence_plugin)
+
+    # chunk ids are recorded before any chunk is queued, so the reducer always finds all of them
+    chunk_ids = [str(uuid.uuid4()) for _ in chunks]
+    job.meta["chunks"] = chunk_ids
+    job.save_meta()
+    rq.connection.set(get_fan_out_key(job.id), len(chunks), ex=FAN_OUT_KEY_TTL)
+
+    for chunk_id, chunk_targets in zip(chunk_ids, chunks):
+        async_analysis_chunk.queue(kwargs, chunk_targets, job.id, job_id=chunk_id)
+
+    return {"chunks": chunk_ids}
+
+
+@rq.job()
+def async_analysis_chunk(kwargs, chunk_targets, parent_id):
+    """Collects from and analyzes one chunk of a fanned out analysis.
+
+    The outcome is recorded for the reducer before the chunk is counted as done, whether
+    the chunk succeeded or failed, so the reducer always runs and sees every chunk.
+    """
+    data = analysis_input_schema.load(kwargs).data
+    chunk_id = get_current_job().id
+
+    progress = get_job_progress()
+    try:
+        results = analyze_targets(
+            data["target_key"],
+            chunk_targets,
+            data["payload_plugin"],
+            data["collection_plugin"],
+            data["persistence_plugin"],
+            data["analysis_plugin"],
+            progress=progress,
+            incident_id=data["incident_id"],
+        )
+    except Exception:
+        failed_key = get_fan_out_failed_key(parent_id)
+        rq.connection.sadd(failed_key, chunk_id)
+        rq.connection.expire(failed_key, FAN_OUT_KEY_TTL)
+        complete_chunk(kwargs, parent_id)
+        raise
+    finally:
+        if progress:
+            progress.flush()
+
+    rq.connection.set(
+        get_fan_out_result_key(parent_id, chunk_id), json.dumps(results, default=str), ex=FAN_OUT_KEY_TTL
+    )
+    complete_chunk(kwargs, parent_id)
+    return results
+
+
+def complete_chunk(kwargs: dict, parent_id: str) -> None:
+    """Counts a chunk as done, queuing the reducer once every chunk is."""
+    if rq.connection.decr(get_fan_out_key(parent_id)) == 0:
+        # waits on the parent so the reducer never races it finishing
+        async_analysis_reduce.queue(kwargs, parent_id, depends_on=parent_id)
+
+
+def fail_job(job, reason: str) -> None:
+    """Marks a job that has already finished as failed, e.g. when work it fanned out failed."""
+    queue = rq.get_queue()
+    FinishedJobRegistry(queue=queue).remove(job)
+    job.set_status(JobStatus.FAILED)
+    FailedJobRegistry(queue=queue).add(job, exc_string=reason)
+
+
+@rq.job()
+def async_analysis_reduce(kwargs, parent_id):
+    """Assembles the analysis document from the results of each chunk.
+
+    When any chunk failed the analysis document is left as it was, and the parent job is
+    marked as failed with the failed chunks listed in its meta.
+    """
+    data = analysis_input_schema.load(kwargs).data
+    parent = rq.get_queue().fetch_job(parent_id)
+    chunk_ids = parent.meta["chunks"]
+
+    failed_key = get_fan_out_failed_key(parent_id)
+    failed = sorted(c.decode("utf-8") for c in rq.connection.smembers(failed_key))
+
+    results = []
+    for chunk_id in chunk_ids:
+        if chunk_id not in failed:
+            results.extend(json.loads(rq.connection.get(get_fan_out_result_key(parent_id, chunk_id))))
+
+    rq.connection.delete(
+        get_fan_out_key(parent_id), failed_key, *[get_fan_out_result_key(parent_id, c) for c in chunk_ids]
+    )
+
+    if failed:
+        parent.meta["failed_chunks"] = failed
+        parent.save_meta()
+        fail_job(parent, f"Analysis chunks failed. TargetKey: {data['target_key']} Chunks: {failed}")
+        return {"failed_chunks": failed}
+
+    return save_analysis(
+        data["target_key"], results, data["persistence_plugin"], incident_id=data["incident_id"]
+    )
@@ -37,6 +37,24 @@ class TaskOutputSchema(DiffyOutputSchema):
     created_at = fields.DateTime()
     args = fields.Dict()
     status = fields.String(attribute="status")
+    progress = fields.Dict(attribute="meta.progress")
+    failed_chunks = fields.List(fields.String(), attribute="meta.failed_chunks")
+
+
+class TaskSummaryOutputSchema(DiffyOutputSchema):
+    id = fields.String()
+    created_at = fields.DateTime()
+    ended_at = fields.DateTime()
+    status = fields.String()
+    progress = fields.Dict()
+
+
+class SummaryOutputSchema(DiffyOutputSchema):
+    key = fields.String()
+    file_type = fields.String()
+    collected_at = fields.String()
+    instances = fields.Integer()
+    size = fields.Integer()
 
 
 class TaskInputSchema(DiffyInputSchema):
@@ -49,4 +67,6 @@ analysis_input_schema = AnalysisSchema()
 analysis_output_schema = AnalysisSchema()
 task_output_schema = TaskOutputSchema()
 task_list_output_schema = TaskOutputSchema(many=True)
+task_summary_list_output_schema = TaskSummaryOutputSchema(many=True)
 task_input_schema = TaskInputSchema()
+summary_list_output_schema = SummaryOutputSchema(many=True)
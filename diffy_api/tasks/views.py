@@ -5,25 +5,117 @@
     :license: Apache, see LICENSE for more details.
 .. moduleauthor:: Kevin Glisson <kglisson@netflix.com>
 """
+from bisect import bisect_right
+from typing import List, Optional, Tuple
+
 from flask import Blueprint
-from flask_restful import Api, Resource
+from flask_restful import reqparse, Api, Resource
+from rq.job import Job, loads
+from rq.utils import as_text, utcparse
 
+from diffy.common.utils import decode_cursor, encode_cursor
+from diffy_api.core import PROGRESS_COUNTERS
 from diffy_api.extensions import rq
-from diffy_api.common.util import validate_schema
-from diffy_api.schemas import task_output_schema, task_list_output_schema
+from diffy_api.common.util import get_page_args, validate_schema
+from diffy_api.schemas import task_output_schema, task_summary_list_output_schema
 
 
 mod = Blueprint("tasks", __name__)
 api = Api(mod)
 
+# the job hash fields needed to summarize a task, leaving out its arguments and result
+SUMMARY_FIELDS = ("status", "created_at", "ended_at", "meta")
+
+
+def get_task_ids(queue) -> List[str]:
+    """Lists the ids of queued, running, finished and failed tasks."""
+    return (
+        queue.get_job_ids()
+        + queue.deferred_job_registry.get_job_ids()
+        + queue.started_job_registry.get_job_ids()
+        + queue.finished_job_registry.get_job_ids()
+        + queue.failed_job_registry.get_job_ids()
+    )
+
+
+def get_task_keys(connection, task_ids: List[str]) -> List[Tuple[str, str]]:
+    """Orders tasks by when they were created, then by id.
+
+    Unlike their position in the queue and registries, neither changes as a task moves
+    between states, so pages keyed by them neither skip nor repeat tasks.
+    """
+    pipeline = connection.pipeline()
+    for task_id in task_ids:
+        pipeline.hget(Job.key_for(task_id), "created_at")
+
+    keys = {
+        (as_text(created_at), task_id)
+        for task_id, created_at in zip(task_ids, pipeline.execute())
+        if created_at is not None  # expired since its id was listed
+    }
+    return sorted(keys)
+
+
+def encode_task_cursor(key: Tuple[str, str]) -> str:
+    """Encodes the (created at, id) key of the last task of a page into a cursor."""
+    return encode_cursor(" ".join(key))
+
+
+def decode_task_cursor(cursor: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Decodes a task cursor back into the (created at, id) key to continue after."""
+    key = decode_cursor(cursor)
+    if key is None:
+        return None
+    return tuple(key.split(" ", 1))
+
+
+def get_task_summaries(connection, task_ids: List[str]) -> List[dict]:
+    """Reads just the status, timestamps and meta of each task, without deserialising the job."""
+    pipeline = connection.pipeline()
+    for task_id in task_ids:
+        pipeline.hmget(Job.key_for(task_id), *SUMMARY_FIELDS)
+
+    summaries = []
+    for task_id, (status, created_at, ended_at, meta) in zip(task_ids, pipeline.execute()):
+        if status is None and created_at is None:
+            continue  # expired since its id was listed
+
+        meta = loads(meta) if meta else {}
+        summaries.append(
+            {
+                "id": task_id,
+                "status": as_text(status) if status else None,
+                "created_at": utcparse(as_text(created_at)) if created_at else None,
+                "ended_at": utcparse(as_text(ended_at)) if ended_at else None,
+                "progress": meta.get("progress"),
+                "chunks": meta.get("chunks"),
+            }
+        )
+    return summaries
+
+
+def get_progress(connection, progress: dict, chunk_ids: List[str]) -> dict:
+    """Adds up the progress of a fanned out analysis and its chunks."""
+    if not chunk_ids:
+        return progress
+
+    total = dict(progress or {})
+    for summary in get_task_summaries(connection, chunk_ids):
+        for counter in PROGRESS_COUNTERS:
+            if counter == "targeted":
+                continue  # already counted by the parent
+            total[counter] = total.get(counter, 0) + (summary["progress"] or {}).get(counter, 0)
+    return total
+
 
 class TaskList(Resource):
     """Defines the 'taskss' endpoints"""
 
     def __init__(self):
+        self.reqparse = reqparse.RequestParser()
         super(TaskList, self).__init__()
 
-    @validate_schema(None, task_list_output_schema)
+    @validate_schema(None, task_summary_list_output_schema)
     def get(self):
         """
         .. http:get:: /tasks
@@ -31,7 +123,7 @@ class TaskList(Resource):
 
           **Example request**:
           .. sourcecode:: http
-             GET /tasks HTTP/1.1
+             GET /tasks?limit=1 HTTP/1.1
              Host: example.com
              Accept: application/json, text/javascript
 
@@ -41,14 +133,43 @@ class TaskList(Resource):
              Vary: Accept
              Content-Type: text/javascript
 
-             # TODO
+             {
+               "total": 2,
+               "items": [
+                 {
+                   "id": "0c3f3a9e-8a87-4a47-9a3b-8e9a3e3c2f11",
+                   "status": "started",
+                   "createdAt": "2018-11-30T23:15:31+00:00",
+                   "endedAt": null,
+                   "progress": {"targeted": 1000, "collected": 420, "diffed": 400, "persisted": 350}
+                 }
+               ],
+               "cursor": "MjAxOC0xMS0zMFQyMzoxNTozMS4wMDAwMDBaIDBjM2YzYTllLThhODctNGE0Ny05YTNiLThlOWEzZTNjMmYxMQ=="
+             }
+
+          :query limit: number of tasks to return
+          :query cursor: cursor returned by the previous page
 
           :statuscode 200: no error
+          :statuscode 400: the cursor is malformed
           :statuscode 403: unauthenticated
         """
-        queue = rq.get_queue()
-        data = queue.get_jobs()
-        return data, 200
+        page = get_page_args(self.reqparse)
+        after = decode_task_cursor(page["cursor"])
+
+        keys = get_task_keys(rq.connection, get_task_ids(rq.get_queue()))
+        start = bisect_right(keys, after) if after else 0
+        page_keys = keys[start : start + page["limit"]]
+
+        items = get_task_summaries(rq.connection, [task_id for _, task_id in page_keys])
+        for i in items:
+            i["progress"] = get_progress(rq.connection, i["progress"], i.pop("chunks"))
+
+        cursor = None
+        if start + page["limit"] < len(keys):
+            cursor = encode_task_cursor(page_keys[-1])
+
+        return {"total": len(keys), "items": items, "cursor": cursor}
 
 
 class Task(Resource):
@@ -81,7 +202,13 @@ class Task(Resource):
           :statuscode 403: unauthenticated
         """
         queue = rq.get_queue()
-        return queue.fetch_job(task_id)
+        job = queue.fetch_job(task_id)
+
+        if job:
+            job.meta["progress"] = get_progress(
+                rq.connection, job.meta.get("progress"), job.meta.get("chunks")
+            )
+        return job
 
 
 api.add_resource(Task, "/tasks/<task_id>")
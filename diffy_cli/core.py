@@ -15,6 +15,7 @@ from diffy.plugins.base import plugins
 from diffy.core import analysis, baseline
 from diffy.exceptions import DiffyException
 from diffy_cli.utils.dynamic_click import CORE_COMMANDS, func_factory, params_factory
+from diffy_cli.utils.option_cache import get_plugin_specs
 
 log = logging.getLogger("diffy")
 log.addFilter(AWSFilter())
@@ -26,12 +27,12 @@ install_plugins()
 
 def plugin_command_factory():
     """Dynamically generate plugin groups for all plugins, and add all basic command to it"""
-    for p in plugins.all():
-        plugin_name = p.slug
+    for spec in get_plugin_specs():
+        plugin_name = spec["slug"]
         help = f"Options for '{plugin_name}'"
         group = click.Group(name=plugin_name, help=help)
         for name, description in CORE_COMMANDS.items():
-            callback = func_factory(p, name)
+            callback = func_factory(plugin_name, name)
             pretty_opt = click.Option(
                 ["--pretty/--not-pretty"], help="Output a pretty version of the JSON"
             )
@@ -47,24 +48,15 @@ def plugin_command_factory():
         plugins_group.add_command(group)
 
 
-def get_plugin_properties(json_schema):
-    for k, v in json_schema["definitions"].items():
-        return v["properties"]
-
-
 def add_plugins_args(f):
     """Adds installed plugin options."""
-    schemas = []
+    schemas = [spec["properties"] for spec in get_plugin_specs()]
     if isinstance(f, click.Command):
-        for p in plugins.all():
-            schemas.append(get_plugin_properties(p.json_schema))
         f.params.extend(params_factory(schemas))
     else:
         if not hasattr(f, "__click_params__"):
             f.__click_params__ = []
 
-        for p in plugins.all():
-            schemas.append(get_plugin_properties(p.json_schema))
         f.__click_params__.extend(params_factory(schemas))
     return f
 
@@ -82,13 +74,17 @@ class YAML(click.ParamType):
 
 def get_plugin_callback(ctx: object, param: str, value: str) -> object:
     """Ensures that the plugin selected is available."""
-    for p in plugins.all(plugin_type=param.name.split("_")[0]):
-        if p.slug == value:
-            return {"plugin": p, "options": {}}
+    if value is None:
+        return None  # optional plugins, such as the inventory, may be left out
 
-    raise click.BadParameter(
-        f"Could not find appropriate plugin. Param: {param.name} Value: {value}"
-    )
+    try:
+        p = plugins.get(value, plugin_type=param.name.split("_")[0])
+    except KeyError:
+        raise click.BadParameter(
+            f"Could not find appropriate plugin. Param: {param.name} Value: {value}"
+        )
+
+    return {"plugin": p, "options": {}}
 
 
 @click.group()
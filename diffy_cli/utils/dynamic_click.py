@@ -4,6 +4,7 @@ from typing import List
 
 import click
 
+from diffy.plugins.base import plugins
 from diffy_cli.utils.json_schema import (
     COMPLEX_TYPES,
     json_schema_to_click_type,
@@ -101,13 +102,14 @@ def func_factory(p, method: str) -> callable:
     """
     Dynamically generates callback commands to correlate to provider public methods
 
-    :param p: A :class:`notifiers.core.Provider` object
+    :param p: A :class:`notifiers.core.Provider` object, or the slug of a plugin to load when called
     :param method: A string correlating to a provider method
     :return: A callback func
     """
 
     def callback(pretty: bool = False):
-        res = getattr(p, method)
+        provider = plugins.get(p) if isinstance(p, str) else p
+        res = getattr(provider, method)
         dump = partial(json.dumps, indent=4) if pretty else partial(json.dumps)
         click.echo(dump(res))
 
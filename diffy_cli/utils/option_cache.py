@@ -0,0 +1,185 @@
+"""
+.. module: diffy_cli.utils.option_cache
+    :platform: Unix
+    :copyright: (c) 2018 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+.. moduleauthor:: Kevin Glisson <kglisson@netflix.com>
+"""
+import os
+import sys
+import json
+import hashlib
+import logging
+import importlib
+import importlib.util
+import tempfile
+from typing import Any, List
+
+from diffy.config import CONFIG
+from diffy._version import __version__
+from diffy.common.utils import get_entry_points
+from diffy.plugins.base import plugins
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = "cli-options.json"
+
+# marks a callable default, such as a lookup of the current AWS account, stored by reference
+CALLABLE_REF = "$callable"
+
+
+class LazyDefault(object):
+    """A callable option default that only imports the function it refers to when called."""
+
+    def __init__(self, ref: str):
+        self.ref = ref
+
+    def __call__(self):
+        module_name, _, name = self.ref.partition(":")
+        func = importlib.import_module(module_name)
+        for attr in name.split("."):
+            func = getattr(func, attr)
+        return func()
+
+    def __repr__(self):
+        return f"LazyDefault({self.ref})"
+
+
+def get_module_mtime(class_path: str) -> int:
+    """Finds when the module defining a plugin was last changed, without importing it."""
+    try:
+        spec = importlib.util.find_spec(class_path.rsplit(".", 1)[0])
+        return os.stat(spec.origin).st_mtime_ns
+    except Exception:
+        return 0
+
+
+def get_cache_key() -> str:
+    """Identifies the installed plugins, their versions, the code defining them and the
+    configuration their option defaults are read from."""
+    versions = {ep.value: getattr(getattr(ep, "dist", None), "version", None) for ep in get_entry_points("diffy.plugins")}
+
+    state = [__version__, json.dumps(dict(CONFIG), sort_keys=True, default=str)]
+    for class_path in sorted(plugins.get_class_list()):
+        module_name, _, class_name = class_path.rpartition(".")
+        state.append(
+            [class_path, versions.get(f"{module_name}:{class_name}"), get_module_mtime(class_path)]
+        )
+    return hashlib.sha1(json.dumps(state).encode("utf-8")).hexdigest()  # nosec: not used for security
+
+
+class UncacheableValue(ValueError):
+    """Raised for option values that can not be stored in, and read back from, the cache."""
+
+
+def resolve_ref(ref: str) -> Any:
+    """Finds the object a callable reference points to among the imported modules."""
+    module_name, _, name = ref.partition(":")
+    value = sys.modules.get(module_name)
+    for attr in name.split("."):
+        value = getattr(value, attr, None)
+    return value
+
+
+def dump_value(value: Any) -> Any:
+    """Makes a JSON schema serialisable, storing callables by reference.
+
+    :raises UncacheableValue: For callables that can not be found again by reference, such
+        as lambdas, nested functions or instances.
+    """
+    if isinstance(value, dict):
+        return {k: dump_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [dump_value(v) for v in value]
+    if callable(value):
+        ref = f"{getattr(value, '__module__', None)}:{getattr(value, '__qualname__', None)}"
+        if resolve_ref(ref) is not value:
+            raise UncacheableValue(f"Callable can not be stored by reference. Value: {value!r}")
+        return {CALLABLE_REF: ref}
+    return value
+
+
+def load_value(value: Any) -> Any:
+    """Reverses :func:`dump_value`, turning callable references into :class:`LazyDefault`."""
+    if isinstance(value, dict):
+        if list(value.keys()) == [CALLABLE_REF]:
+            return LazyDefault(value[CALLABLE_REF])
+        return {k: load_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [load_value(v) for v in value]
+    return value
+
+
+def get_plugin_properties(json_schema: dict) -> dict:
+    for k, v in json_schema["definitions"].items():
+        return v["properties"]
+
+
+def build_plugin_specs() -> List[dict]:
+    """Generates the option spec of every plugin from its JSON schema, importing every plugin."""
+    return [
+        {"slug": p.slug, "properties": get_plugin_properties(p.json_schema)}
+        for p in plugins.all()
+    ]
+
+
+def get_cache_path() -> str:
+    directory = CONFIG.get("DIFFY_CLI_CACHE_DIRECTORY")
+    if directory:
+        return os.path.join(os.path.expanduser(str(directory)), CACHE_FILE)
+
+
+def read_cache(path: str, key: str):
+    try:
+        with open(path, "r") as f:
+            cached = json.load(f)
+    except (IOError, ValueError):
+        return None
+
+    if cached.get("key") == key:
+        return cached["specs"]
+
+
+def write_cache(path: str, key: str, specs: List[dict]) -> None:
+    """Stores the option specs, skipping the cache when any of their values can not be stored."""
+    try:
+        data = json.dumps({"key": key, "specs": dump_value(specs)})
+    except (TypeError, ValueError) as e:
+        logger.debug(f"Unable to cache CLI options, a value can not be stored. Reason: {e}")
+        return
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except (IOError, OSError) as e:
+        logger.debug(f"Unable to cache CLI options. Path: {path} Reason: {e}")
+
+
+_specs = None
+
+
+def get_plugin_specs() -> List[dict]:
+    """Returns the option spec of every plugin, from the on disk cache while the installed plugins are unchanged.
+
+    :returns: List of dicts with the plugin `slug` and the JSON schema `properties` of its options.
+    """
+    global _specs
+    if _specs is not None:
+        return _specs
+
+    path = get_cache_path()
+    key = get_cache_key() if path else None
+
+    specs = read_cache(path, key) if path else None
+    if specs is not None:
+        _specs = load_value(specs)
+        return _specs
+
+    logger.debug("Generating CLI options from plugin schemas.")
+    _specs = build_plugin_specs()
+    if path:
+        write_cache(path, key, _specs)
+    return _specs
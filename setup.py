@@ -73,7 +73,9 @@ setup(
             "aws_collection_ssm = diffy.plugins.diffy_aws.plugin:SSMCollectionPlugin",
             "aws_target_auto_scaling_group = diffy.plugins.diffy_aws.plugin:AutoScalingTargetPlugin",
             "local_analysis_simple = diffy.plugins.diffy_local.plugin:SimpleAnalysisPlugin",
+            "local_analysis_row = diffy.plugins.diffy_local.plugin:RowAnalysisPlugin",
             "local_analysis_cluster = diffy.plugins.diffy_local.plugin:ClusterAnalysisPlugin",
+            "local_analysis_consensus = diffy.plugins.diffy_local.plugin:ConsensusAnalysisPlugin",
             "local_persistence_file = diffy.plugins.diffy_local.plugin:FilePersistencePlugin",
             "local_payload_command = diffy.plugins.diffy_local.plugin:CommandPayloadPlugin",
             "local_shell_collection = diffy.plugins.diffy_local.plugin:LocalShellCollectionPlugin",
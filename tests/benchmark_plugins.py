@@ -0,0 +1,50 @@
+"""
+.. module: tests.benchmark_plugins
+    :platform: Unix
+    :copyright: (c) 2018 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Measures plugin lookups by slug once every plugin has been imported, against a
+scan of the sorted registry::
+
+    python tests/benchmark_plugins.py --number 10000
+"""
+import argparse
+import timeit
+
+from diffy.common.utils import install_plugins
+from diffy.plugins.base import plugins
+from diffy.schema import resolve_plugin_slug
+
+
+def scan(slug):
+    """Looks a slug up the way the manager did before it kept an index."""
+    for version in (1, 2):
+        for plugin in plugins.all(version=version):
+            if plugin.slug == slug:
+                return plugin
+    raise KeyError(slug)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=10000)
+    args = parser.parse_args()
+
+    install_plugins()
+    slugs = [p.slug for p in plugins.all(version=None)]
+
+    scenarios = {
+        "scan": lambda: [scan(s) for s in slugs],
+        "get": lambda: [plugins.get(s) for s in slugs],
+        "resolve_plugin_slug": lambda: [resolve_plugin_slug(s) for s in slugs],
+    }
+
+    print(f"{len(slugs)} plugins, {args.number} lookups of each")
+    for name, func in scenarios.items():
+        elapsed = timeit.timeit(func, number=args.number)
+        print(f"{name:<24} {elapsed / (args.number * len(slugs)) * 1e6:8.2f}us per lookup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+.. module: tests.benchmark_startup
+    :platform: Unix
+    :copyright: (c) 2018 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Measures how long diffy takes to start, each run in a fresh interpreter::
+
+    python tests/benchmark_startup.py --runs 10
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+SCENARIOS = {
+    "cli --help": "import sys; sys.argv = ['diffy', '--help']; from diffy_cli.core import entry_point; entry_point()",
+    "resolve local plugin": (
+        "from diffy.common.utils import install_plugins; from diffy.plugins.base import plugins; "
+        "install_plugins(); plugins.get('local-file')"
+    ),
+    "import every plugin": (
+        "from diffy.common.utils import install_plugins; from diffy.plugins.base import plugins; "
+        "install_plugins(); list(plugins.all())"
+    ),
+}
+
+
+def measure(code: str, runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", code],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, code in SCENARIOS.items():
+        timings = measure(code, args.runs)
+        print(
+            f"{name:<24} median: {statistics.median(timings) * 1000:8.1f}ms "
+            f"min: {min(timings) * 1000:8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -36,6 +36,72 @@ def client(app, client):
     yield client
 
 
+@pytest.fixture(scope="function", autouse=True)
+def local_file_directory(tmpdir, monkeypatch):
+    """Keeps local file persistence, and its index, out of the source tree."""
+    from diffy.config import CONFIG
+
+    monkeypatch.setitem(CONFIG, "DIFFY_LOCAL_FILE_DIRECTORY", str(tmpdir))
+    yield tmpdir
+
+
+@pytest.fixture(scope="function")
+def rq_connection(monkeypatch):
+    """Points the task queue at an in memory redis."""
+    import fakeredis
+    from diffy_api.extensions import rq
+
+    connection = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(rq, "_connection", connection)
+    monkeypatch.setattr(rq, "_queue_instances", {})
+    yield connection
+
+
+@pytest.fixture(scope="function")
+def run_fan_out_analysis(app, monkeypatch, rq_connection):
+    """Runs a fanned out analysis of the given targets with an in process worker.
+
+    Collection and analysis are stubbed out, failing for any chunk holding the `i-bad` target.
+    """
+    from rq import SimpleWorker
+
+    from diffy.plugins.base import plugins
+    from diffy_api import core
+    from diffy_api.extensions import rq
+
+    monkeypatch.setitem(app.config, "DIFFY_API_FAN_OUT_CHUNK_SIZE", 2)
+
+    def analyze_targets(target_key, chunk, *args, progress=None, **kwargs):
+        if "i-bad" in chunk:
+            raise RuntimeError("Collection failed.")
+        progress(collected=len(chunk), diffed=len(chunk), persisted=len(chunk))
+        return [{"instance_id": t} for t in chunk]
+
+    monkeypatch.setattr(core, "analyze_targets", analyze_targets)
+
+    plugins.get("local-file").save(
+        "baseline", "asg", [{"instance_id": "i-0", "command_hash": "0123456789abcdef", "stdout": []}]
+    )
+
+    def run(targets):
+        monkeypatch.setattr(core, "get_targets", lambda *args, **kwargs: targets)
+
+        job = core.async_analysis.queue(
+            {
+                "targetKey": "asg",
+                "incidentId": "1",
+                "targetPlugin": {"slug": "local-target"},
+                "collectionPlugin": {"slug": "local-shell-collection"},
+                "analysisPlugin": {"slug": "local-row"},
+            }
+        )
+        SimpleWorker([rq.get_queue()], connection=rq.connection, job_class=job.__class__).work(burst=True)
+        job.refresh()
+        return job
+
+    yield run
+
+
 @pytest.fixture(scope="function")
 def s3():
     with mock_s3():
@@ -1,3 +1,6 @@
+import json
+from unittest import mock
+
 import pytest
 from diffy_api.analysis.views import *  # noqa
 
@@ -7,6 +10,13 @@ def test_analysis_list_get(client, token, status):
     assert client.get(api.url_for(AnalysisList), headers=token).status_code == status
 
 
+@pytest.mark.parametrize("cursor", ["abc", "_w==", "é"])
+def test_analysis_list_get_bad_cursor(client, cursor):
+    resp = client.get(api.url_for(AnalysisList, cursor=cursor))
+    assert resp.status_code == 400
+    assert "Invalid cursor" in resp.json["message"]
+
+
 @pytest.mark.skip("Fails while moto is broken")
 @pytest.mark.parametrize("token,status", [("", 400)])
 def test_analysis_list_post(client, token, status, sts):
@@ -79,3 +89,70 @@ def test_analysis_patch(client, token, status):
         ).status_code
         == status
     )
+
+
+def test_async_analysis_fan_out(run_fan_out_analysis):
+    targets = [f"i-{n}" for n in range(5)]
+    job = run_fan_out_analysis(targets)
+
+    assert len(job.meta["chunks"]) == 3
+    assert [i["instance_id"] for i in plugins.get("local-file").get("analysis", "asg")] == targets
+
+
+def test_async_analysis_fan_out_chunk_failure(run_fan_out_analysis, rq_connection):
+    from rq.job import JobStatus
+
+    plugins.get("local-file").save("analysis", "asg", [{"instance_id": "i-previous"}])
+
+    job = run_fan_out_analysis(["i-0", "i-1", "i-bad", "i-3"])
+
+    assert job.get_status() == JobStatus.FAILED
+    assert job.meta["failed_chunks"] == [job.meta["chunks"][1]]
+    assert "Analysis chunks failed" in job.exc_info
+
+    # the previous analysis is not replaced by a partial one, and nothing is left behind
+    assert plugins.get("local-file").get("analysis", "asg") == [{"instance_id": "i-previous"}]
+    assert not rq_connection.keys("diffy:fan-out:*")
+
+
+def test_analysis_get_etag(client):
+    p = plugins.get("local-file")
+    p.save("analysis", "asg", [{"instance_id": "i-1", "diff": {}}])
+
+    url = api.url_for(Analysis, key="asg")
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp.json == [{"instance_id": "i-1", "diff": {}}]
+
+    with mock.patch.object(p, "get") as get:
+        assert client.get(url, headers={"If-None-Match": resp.headers["ETag"]}).status_code == 304
+        assert client.get(url).json == [{"instance_id": "i-1", "diff": {}}]
+        assert not get.called
+
+    # a newer save changes the version, so neither the ETag nor the cached body match
+    p.save("analysis", "asg", [{"instance_id": "i-1", "diff": {}}, {"instance_id": "i-2"}])
+
+    resp = client.get(url, headers={"If-None-Match": resp.headers["ETag"]})
+    assert resp.status_code == 200
+    assert len(resp.json) == 2
+
+
+def test_analysis_get_streaming_projection(client):
+    items = [
+        {"instance_id": f"i-{n}", "stdout": [{"name": "sshd"}], "diff": {}} for n in range(3)
+    ]
+    plugins.get("local-file").save("analysis", "asg", items)
+
+    resp = client.get(api.url_for(Analysis, key="asg", fields="instance_id,diff", format="ndjson"))
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/x-ndjson"
+    assert [json.loads(line) for line in resp.data.decode().splitlines()] == [
+        {"instance_id": f"i-{n}", "diff": {}} for n in range(3)
+    ]
+
+    resp = client.get(api.url_for(Analysis, key="asg", fields="instance_id", format="stream"))
+    assert resp.is_streamed
+    assert resp.json == [{"instance_id": f"i-{n}"} for n in range(3)]
+
+    # each representation has its own ETag
+    assert resp.headers["ETag"] != client.get(api.url_for(Analysis, key="asg")).headers["ETag"]
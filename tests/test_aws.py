@@ -0,0 +1,418 @@
+import io
+import json
+import threading
+import time
+from datetime import datetime
+from unittest import mock
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+from botocore.stub import Stubber
+
+from diffy.config import CONFIG
+from diffy.exceptions import TargetNotFound
+from diffy.plugins.diffy_aws import auto_scaling, plugin as aws_plugin, s3 as s3_cache, ssm
+from diffy.plugins.diffy_aws.plugin import AWSSchema, AutoScalingTargetPlugin, S3PersistencePlugin
+from diffy.plugins.diffy_aws.sts import cache, sts_client
+
+
+COMMAND_ID = "8dfb2fa2-7a3c-4a0b-9f5e-0d3c6b0f2a11"
+
+CREDENTIALS = {
+    "Credentials": {
+        "AccessKeyId": "AKIAEXAMPLE",
+        "SecretAccessKey": "secret",
+        "SessionToken": "token",
+        "Expiration": datetime(2100, 1, 1),
+    }
+}
+
+
+@pytest.fixture(autouse=True)
+def clear_client_cache():
+    cache.clear()
+    s3_cache.cache.clear()
+    auto_scaling.cache.clear()
+    yield
+    cache.clear()
+    s3_cache.cache.clear()
+    auto_scaling.cache.clear()
+
+
+def _stubbed_clients(**clients):
+    """Patches boto3 so the sts_client decorator hands out the given stubbed clients."""
+    if "sts" not in clients:
+        clients["sts"] = mock.Mock()
+        clients["sts"].assume_role.return_value = CREDENTIALS
+
+    def client(service, *args, **kwargs):
+        return clients[service]
+
+    return mock.patch("diffy.plugins.diffy_aws.sts.boto3.client", side_effect=client)
+
+
+def _invocation(instance_id, status, output=""):
+    return {
+        "InstanceId": instance_id,
+        "Status": status,
+        "CommandPlugins": [
+            {
+                "Status": status,
+                "Output": output,
+                "ResponseFinishDateTime": datetime(2018, 1, 1),
+            }
+        ],
+    }
+
+
+def test_poll_only_requeries_pending_instances():
+    client = boto3.client("ssm", region_name="us-east-1")
+    stubber = Stubber(client)
+
+    list_params = {"CommandId": COMMAND_ID, "Details": True, "MaxResults": 50}
+    stubber.add_response(
+        "list_command_invocations",
+        {
+            "CommandInvocations": [
+                _invocation("i-1", "Success", json.dumps([{"name": "sshd"}])),
+                _invocation("i-2", "InProgress"),
+            ]
+        },
+        list_params,
+    )
+    stubber.add_response(
+        "list_command_invocations",
+        {
+            "CommandInvocations": [
+                _invocation("i-1", "Success", json.dumps([{"name": "sshd"}])),
+                _invocation("i-2", "Success", "x" * ssm.MAX_INVOCATION_OUTPUT),
+            ]
+        },
+        list_params,
+    )
+    # only the truncated output is fetched in full
+    stubber.add_response(
+        "get_command_invocation",
+        {
+            "Status": "Success",
+            "ExecutionEndDateTime": "2018-01-01T00:00:00",
+            "StandardOutputContent": json.dumps([{"name": "cron"}]),
+            "StandardErrorContent": "",
+        },
+        {"CommandId": COMMAND_ID, "InstanceId": "i-2"},
+    )
+
+    command_ids = {
+        COMMAND_ID: [
+            {"instance_id": "i-1", "status": "Pending", "stdout": ""},
+            {"instance_id": "i-2", "status": "Pending", "stdout": ""},
+        ]
+    }
+
+    with stubber, _stubbed_clients(ssm=client), mock.patch.object(ssm.time, "sleep"):
+        results = ssm.poll(command_ids, account_number="123456789012", region="us-east-1")
+
+    stubber.assert_no_pending_responses()
+    assert results[COMMAND_ID][0]["stdout"] == [{"name": "sshd"}]
+    assert results[COMMAND_ID][1]["stdout"] == [{"name": "cron"}]
+    assert all(r["status"] == "Success" for r in results[COMMAND_ID])
+
+
+def test_sts_client_reuses_credentials_and_clients():
+    @sts_client("ssm")
+    def get_client(**kwargs):
+        return kwargs["client"]
+
+    sts, ssm_client = mock.Mock(), mock.Mock()
+    sts.assume_role.return_value = CREDENTIALS
+    with _stubbed_clients(sts=sts, ssm=ssm_client):
+        for _ in range(3):
+            assert get_client(account_number="123456789012", region="us-east-1") is ssm_client
+
+    assert sts.assume_role.call_count == 1
+
+    assert cache.stats() == {"hits": 2, "misses": 1}
+
+
+def test_sts_client_refreshes_expiring_credentials():
+    @sts_client("ssm")
+    def get_client(**kwargs):
+        return kwargs["client"]
+
+    sts = mock.Mock()
+    sts.assume_role.return_value = {
+        "Credentials": dict(CREDENTIALS["Credentials"], Expiration=datetime(2000, 1, 1))
+    }
+    with _stubbed_clients(sts=sts, ssm=mock.Mock()):
+        get_client(account_number="123456789012", region="us-east-1")
+        get_client(account_number="123456789012", region="us-east-1")
+
+        assert sts.assume_role.call_count == 2
+
+
+class FakeS3(object):
+    """Minimal S3 client recording how many get_object calls run at once."""
+
+    def __init__(self, keys, delay=0.01):
+        self.objects = {k: json.dumps({"key": k}).encode("utf-8") for k in sorted(keys)}
+        self.delay = delay
+        self.list_calls = 0
+        self.not_modified = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def list_objects_v2(self, Bucket, Prefix, MaxKeys=1000, ContinuationToken=None, StartAfter=None):
+        self.list_calls += 1
+        keys = [k for k in self.objects if k.startswith(Prefix)]
+        start = int(ContinuationToken or 0)
+        if StartAfter:
+            keys = [k for k in keys if k > StartAfter]
+        page = keys[start : start + MaxKeys]
+        response = {
+            "Contents": [
+                {"Key": k, "Size": len(self.objects[k]), "LastModified": datetime(2018, 1, 1)}
+                for k in page
+            ],
+            "IsTruncated": start + MaxKeys < len(keys),
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + MaxKeys)
+        return response
+
+    def etag(self, Key):
+        return '"{}"'.format(hash(self.objects[Key]))
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        if IfNoneMatch == self.etag(Key):
+            self.not_modified += 1
+            raise ClientError({"Error": {"Code": "304"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[Key]), "ETag": self.etag(Key)}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body.encode("utf-8") if isinstance(Body, str) else Body
+        return {"ETag": self.etag(Key)}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+            self.objects[Key] = Fileobj.read()
+
+
+def test_s3_get_all_fetches_in_parallel():
+    keys = [f"baseline/asg-{n:04d}.json" for n in range(2500)] + ["analysis/asg.json"]
+    s3 = FakeS3(keys)
+
+    with _stubbed_clients(s3=s3):
+        items = S3PersistencePlugin().get_all(
+            "baseline", account_number="123456789012", region="us-east-1"
+        )
+
+    assert len(items) == 2500
+    assert items[0] == {"key": "baseline/asg-0000.json"}
+    assert s3.list_calls == 3
+    assert s3.max_active > 1
+
+
+def test_s3_list_is_metadata_only():
+    s3 = FakeS3([f"baseline/asg-{n}.json" for n in range(5)])
+
+    with _stubbed_clients(s3=s3):
+        p = S3PersistencePlugin()
+        page = p.list("baseline", limit=3, account_number="123456789012", region="us-east-1")
+        assert [i["key"] for i in page["items"]] == ["asg-0", "asg-1", "asg-2"]
+
+        page = p.list(
+            "baseline",
+            limit=3,
+            cursor=page["cursor"],
+            account_number="123456789012",
+            region="us-east-1",
+        )
+        assert [i["key"] for i in page["items"]] == ["asg-3", "asg-4"]
+        assert page["cursor"] is None
+
+    assert s3.max_active == 0
+
+
+def test_s3_save_many_uploads_in_parallel():
+    s3 = FakeS3([])
+    items = {f"asg-i-{n}": {"instance_id": f"i-{n}"} for n in range(500)}
+
+    with _stubbed_clients(s3=s3):
+        S3PersistencePlugin().save_many(
+            None, items, account_number="123456789012", region="us-east-1"
+        )
+
+    assert len(s3.objects) == 500
+    assert json.loads(s3.objects["asg-i-7.json"]) == {"instance_id": "i-7"}
+    assert s3.max_active > 1
+
+
+def test_s3_get_revalidates_cached_copy():
+    s3 = FakeS3(["baseline/asg.json"])
+    options = dict(account_number="123456789012", region="us-east-1")
+
+    with _stubbed_clients(s3=s3):
+        p = S3PersistencePlugin()
+        assert p.get("baseline", "asg", **options) == {"key": "baseline/asg.json"}
+        assert p.get("baseline", "asg", **options) == {"key": "baseline/asg.json"}
+        assert s3.not_modified == 1
+
+        p.save("baseline", "asg", {"key": "updated"}, **options)
+        assert p.get("baseline", "asg", **options) == {"key": "updated"}
+        assert s3.not_modified == 2
+
+        assert p.get("baseline", "missing", **options) is None
+
+
+def test_default_account_number_is_looked_up_once(monkeypatch):
+    monkeypatch.setattr(aws_plugin, "_account_number", None)
+    monkeypatch.setattr(aws_plugin, "_account_failed_at", None)
+    monkeypatch.setitem(CONFIG, "DIFFY_AWS_ACCOUNT_NUMBER", None)
+    monkeypatch.setitem(CONFIG, "DIFFY_AWS_OFFLINE", False)
+
+    sts = mock.Mock()
+    sts.get_caller_identity.return_value = {"Account": "123456789012"}
+    with mock.patch.object(aws_plugin.boto3, "client", return_value=sts) as client:
+        for _ in range(3):
+            assert AWSSchema().load({}).data["account_number"] == "123456789012"
+
+    assert client.call_count == 1
+    assert sts.get_caller_identity.call_count == 1
+
+
+def test_default_account_number_offline(monkeypatch):
+    monkeypatch.setattr(aws_plugin, "_account_number", None)
+    monkeypatch.setattr(aws_plugin, "_account_failed_at", None)
+    monkeypatch.setitem(CONFIG, "DIFFY_AWS_ACCOUNT_NUMBER", None)
+    monkeypatch.setitem(CONFIG, "DIFFY_AWS_OFFLINE", True)
+
+    with mock.patch.object(aws_plugin.boto3, "client") as client:
+        assert aws_plugin.get_default_aws_account_number() == aws_plugin.FALLBACK_ACCOUNT_NUMBER
+
+        monkeypatch.setitem(CONFIG, "DIFFY_AWS_ACCOUNT_NUMBER", "123456789012")
+        assert aws_plugin.get_default_aws_account_number() == "123456789012"
+
+    assert not client.called
+
+
+def test_default_account_number_falls_back_when_unreachable(monkeypatch):
+    monkeypatch.setattr(aws_plugin, "_account_number", None)
+    monkeypatch.setattr(aws_plugin, "_account_failed_at", None)
+    monkeypatch.setitem(CONFIG, "DIFFY_AWS_ACCOUNT_NUMBER", None)
+    monkeypatch.setitem(CONFIG, "DIFFY_AWS_OFFLINE", False)
+
+    sts = mock.Mock()
+    sts.get_caller_identity.side_effect = EndpointConnectionError(endpoint_url="https://sts.amazonaws.com")
+    with mock.patch.object(aws_plugin.boto3, "client", return_value=sts) as client:
+        assert aws_plugin.get_default_aws_account_number() == aws_plugin.FALLBACK_ACCOUNT_NUMBER
+        assert aws_plugin.get_default_aws_account_number() == aws_plugin.FALLBACK_ACCOUNT_NUMBER
+
+        assert client.call_args[1]["config"].connect_timeout == CONFIG["DIFFY_AWS_IDENTITY_TIMEOUT"]
+        assert sts.get_caller_identity.call_count == 1
+
+        # the failure is not remembered past the retry interval
+        monkeypatch.setitem(CONFIG, "DIFFY_AWS_IDENTITY_RETRY_INTERVAL", 0)
+        sts.get_caller_identity.side_effect = None
+        sts.get_caller_identity.return_value = {"Account": "123456789012"}
+        assert aws_plugin.get_default_aws_account_number() == "123456789012"
+        assert aws_plugin.get_default_aws_account_number() == "123456789012"
+
+    assert sts.get_caller_identity.call_count == 2
+
+
+class FakeAutoScaling(object):
+    """Minimal Auto Scaling client paging through groups of two instances each."""
+
+    def __init__(self, names, tags=None):
+        self.groups = [
+            {
+                "AutoScalingGroupName": name,
+                "Instances": [{"InstanceId": f"i-{name}-{n}"} for n in range(2)],
+                "Tags": [{"Key": k, "Value": v} for k, v in (tags or {}).get(name, {}).items()],
+            }
+            for name in names
+        ]
+        self.calls = []
+
+    def describe_auto_scaling_groups(self, MaxRecords, AutoScalingGroupNames=None, Filters=None, NextToken=None):
+        self.calls.append(AutoScalingGroupNames or Filters)
+        assert AutoScalingGroupNames is None or len(AutoScalingGroupNames) <= 50
+
+        groups = self.groups
+        if AutoScalingGroupNames is not None:
+            groups = [g for g in groups if g["AutoScalingGroupName"] in AutoScalingGroupNames]
+        for f in Filters or []:
+            tag = f["Name"][len("tag:"):]
+            groups = [g for g in groups if {"Key": tag, "Value": f["Values"][0]} in g["Tags"]]
+
+        start = int(NextToken or 0)
+        response = {"AutoScalingGroups": groups[start : start + MaxRecords]}
+        if start + MaxRecords < len(groups):
+            response["NextToken"] = str(start + MaxRecords)
+        return response
+
+
+def test_auto_scaling_target_batches_and_caches_groups():
+    names = [f"asg-{n:03d}" for n in range(120)]
+    autoscaling = FakeAutoScaling(names)
+    options = dict(account_number="123456789012", region="us-east-1")
+
+    with _stubbed_clients(autoscaling=autoscaling):
+        p = AutoScalingTargetPlugin()
+        instances = p.get(",".join(names + ["asg-missing"]), **options)
+        assert len(instances) == 240
+        assert instances[:2] == ["i-asg-000-0", "i-asg-000-1"]
+        assert [len(c) for c in autoscaling.calls] == [50, 50, 21]
+
+        # every group is now cached
+        assert p.get("asg-042", **options) == ["i-asg-042-0", "i-asg-042-1"]
+        assert len(autoscaling.calls) == 3
+
+        with pytest.raises(TargetNotFound):
+            p.get("asg-missing", **options)
+
+
+def test_auto_scaling_target_pages_through_tag_filter():
+    names = [f"asg-{n:03d}" for n in range(250)]
+    tags = {name: {"team": "diffy"} for name in names[::2]}
+    autoscaling = FakeAutoScaling(names, tags)
+    options = dict(account_number="123456789012", region="us-east-1")
+
+    with _stubbed_clients(autoscaling=autoscaling):
+        p = AutoScalingTargetPlugin()
+        assert len(p.get("tag:team=diffy", **options)) == 250
+        assert len(autoscaling.calls) == 2
+
+        assert len(p.get("tag:team=diffy, asg-001", **options)) == 252
+        assert len(autoscaling.calls) == 3
+
+
+def test_s3_cache_hands_out_copies():
+    s3 = FakeS3(["baseline/asg.json"])
+    options = dict(account_number="123456789012", region="us-east-1")
+
+    with _stubbed_clients(s3=s3):
+        p = S3PersistencePlugin()
+        p.get("baseline", "asg", **options)["content_hash"] = "changed"
+        assert p.get("baseline", "asg", **options) == {"key": "baseline/asg.json"}
+
+        item = {"key": "saved"}
+        p.save("baseline", "asg", item, **options)
+        item["key"] = "changed"
+        assert p.get("baseline", "asg", **options) == {"key": "saved"}
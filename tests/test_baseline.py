@@ -80,3 +80,32 @@ def test_baseline_patch(client, token, status):
         ).status_code
         == status
     )
+
+
+def test_baseline_list_pagination(client):
+    p = plugins.get("local-file")
+    for key in ["asg-a", "asg-b", "asg-c"]:
+        p.save("baseline", key, {"instance_id": "i-1", "stdout": []})
+
+    resp = client.get(api.url_for(BaselineList) + "?limit=2")
+    assert resp.status_code == 200
+    assert resp.json["total"] == 3
+    assert [i["key"] for i in resp.json["items"]] == ["asg-a", "asg-b"]
+    assert resp.json["items"][0]["fileType"] == "baseline"
+
+    resp = client.get(api.url_for(BaselineList) + f"?limit=2&cursor={resp.json['cursor']}")
+    assert [i["key"] for i in resp.json["items"]] == ["asg-c"]
+    assert resp.json["cursor"] is None
+
+
+def test_baseline_get_hides_row_index(client):
+    from diffy.plugins.base import plugins
+
+    plugins.get("local-file").save(
+        "baseline", "asg", [{"instance_id": "i-1", "stdout": [{"name": "sshd"}], "row_hashes": ["abc"]}]
+    )
+
+    for query in ({}, {"format": "ndjson"}):
+        resp = client.get(api.url_for(Baseline, key="asg", **query))
+        assert resp.status_code == 200
+        assert "row_hashes" not in resp.get_data(as_text=True)
@@ -0,0 +1,116 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from diffy.config import CONFIG
+from diffy_cli.utils import option_cache
+from diffy_cli.utils.option_cache import (
+    LazyDefault,
+    UncacheableValue,
+    dump_value,
+    get_cache_key,
+    load_value,
+    write_cache,
+)
+
+HELP = (
+    "import sys;"
+    "sys.argv = ['diffy', 'new', 'baseline', '--help'];"
+    "from diffy_cli.core import entry_point;"
+    "exec('try:\\n entry_point()\\nexcept SystemExit:\\n pass');"
+    "print('diffy.plugins.diffy_aws.plugin' in sys.modules)"
+)
+
+# a local baseline, reporting whether the AWS plugins were imported and the account looked up
+BASELINE = (
+    "import sys;"
+    "sys.argv = ['diffy', 'new', 'baseline', 'localhost'];"
+    "from diffy.config import CONFIG;"
+    "CONFIG['DIFFY_PAYLOAD_LOCAL_COMMANDS'] = ['echo []'];"
+    "from diffy_cli.core import entry_point;"
+    "exec('try:\\n entry_point()\\nexcept SystemExit:\\n pass');"
+    "aws = sys.modules.get('diffy.plugins.diffy_aws.plugin');"
+    "print(aws is not None, bool(aws and (aws._account_number or aws._account_failed_at)))"
+)
+
+
+def _run(tmpdir, code):
+    env = dict(
+        os.environ,
+        DIFFY_CLI_CACHE_DIRECTORY=str(tmpdir),
+        DIFFY_LOCAL_FILE_DIRECTORY=str(tmpdir),
+    )
+    return subprocess.run(
+        [sys.executable, "-c", code], env=env, stdout=subprocess.PIPE, check=True
+    ).stdout.decode("utf-8")
+
+
+def _help(tmpdir):
+    return _run(tmpdir, HELP)
+
+
+def test_cli_options_are_cached(tmpdir):
+    first = _help(tmpdir)
+    assert "--account-number" in first
+    assert first.strip().endswith("True")
+
+    cached = json.loads(tmpdir.join("cli-options.json").read())
+    assert {s["slug"] for s in cached["specs"]} >= {"local-file", "ssm-collection"}
+
+    # the cached options are identical, without importing every plugin
+    second = _help(tmpdir)
+    assert second.strip().endswith("False")
+    assert first.rsplit("\n", 2)[0] == second.rsplit("\n", 2)[0]
+
+
+def test_local_baseline_does_not_look_up_the_aws_account(tmpdir):
+    first = _run(tmpdir, BASELINE).strip().splitlines()
+    assert '"localhost"' in first[0]
+    # every plugin is imported to build the option cache, but the account is never needed
+    assert first[-1] == "True False"
+
+    second = _run(tmpdir, BASELINE).strip().splitlines()
+    assert '"localhost"' in second[0]
+    assert second[-1] == "False False"
+    assert tmpdir.join("baseline-localhost.json").check()
+
+
+def test_callable_defaults_are_stored_by_reference():
+    stored = dump_value({"default": os.getcwd})
+    assert stored == {"default": {"$callable": f"{os.getcwd.__module__}:getcwd"}}
+
+    default = load_value(json.loads(json.dumps(stored)))["default"]
+    assert isinstance(default, LazyDefault)
+    assert default() == os.getcwd()
+
+
+def test_unresolvable_callables_are_not_stored():
+    with pytest.raises(UncacheableValue):
+        dump_value({"default": lambda: "1234"})
+
+
+@pytest.mark.parametrize("default", [Path("/tmp"), lambda: "1234"])
+def test_uncacheable_specs_are_used_without_the_cache(tmpdir, monkeypatch, default):
+    specs = [{"slug": "test", "properties": {"path": {"default": default}}}]
+    monkeypatch.setattr(option_cache, "build_plugin_specs", lambda: specs)
+    monkeypatch.setattr(option_cache, "get_cache_path", lambda: str(tmpdir.join("cli-options.json")))
+    monkeypatch.setattr(option_cache, "_specs", None)
+
+    write_cache(str(tmpdir.join("cli-options.json")), "key", specs)
+    assert not tmpdir.listdir()
+
+    assert option_cache.get_plugin_specs() is specs
+    assert not tmpdir.listdir()
+
+
+def test_cache_key_follows_configured_defaults(monkeypatch):
+    monkeypatch.setitem(CONFIG, "DIFFY_DEFAULT_REGION", "us-west-2")
+    key = get_cache_key()
+    assert get_cache_key() == key
+
+    monkeypatch.setitem(CONFIG, "DIFFY_DEFAULT_REGION", "eu-west-1")
+    assert get_cache_key() != key
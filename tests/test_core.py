@@ -0,0 +1,236 @@
+import json
+import sys
+from unittest import mock
+
+import pytest
+
+from diffy.config import CONFIG
+from diffy.core import analysis, baseline
+from diffy.exceptions import BadArguments
+from diffy.plugins.diffy_local.plugin import (
+    CommandPayloadPlugin,
+    FilePersistencePlugin,
+    LocalShellCollectionPlugin,
+    LocalTargetPlugin,
+    RowAnalysisPlugin,
+    SimpleAnalysisPlugin,
+)
+
+
+def _cat_command(path):
+    code = f"print(open({str(path)!r}).read())"
+    return f"{sys.executable} -c {json.dumps(code)}"
+
+
+@pytest.fixture(scope="function")
+def local_commands(tmpdir, monkeypatch):
+    """Sets up one command per set of rows, each command printing its rows from a file.
+
+    The commands stay the same between calls while their output changes.
+    """
+    def set_commands(*rows):
+        commands = []
+        for n, r in enumerate(rows):
+            path = tmpdir.join(f"command-{n}.out")
+            path.write(json.dumps(r))
+            commands.append(_cat_command(path))
+
+        monkeypatch.setitem(CONFIG, "DIFFY_PAYLOAD_LOCAL_COMMANDS", commands)
+
+    yield set_commands
+
+
+def _plugins(*plugins):
+    return [{"plugin": p, "options": {}} for p in plugins]
+
+
+def test_streaming_analysis(local_commands):
+    target, payload, collection, persistence, analysis_plugin = _plugins(
+        LocalTargetPlugin(),
+        CommandPayloadPlugin(),
+        LocalShellCollectionPlugin(),
+        FilePersistencePlugin(),
+        RowAnalysisPlugin(),
+    )
+
+    local_commands([{"name": "sshd"}])
+    baseline("localhost", target, payload, collection, persistence)
+
+    local_commands([{"name": "sshd"}, {"name": "nc"}])
+    result = analysis("localhost", target, payload, collection, persistence, analysis_plugin)
+
+    assert result["analysis"][0]["diff"] == {"added": [{"name": "nc"}]}
+
+    key = f"localhost-localhost-{result['analysis'][0]['command_hash']}"
+    assert persistence["plugin"].get(None, key)["diff"] == {"added": [{"name": "nc"}]}
+
+
+def test_analysis_skips_unchanged_instances(local_commands, monkeypatch):
+    monkeypatch.setitem(CONFIG, "DIFFY_ANALYSIS_SKIP_UNCHANGED", True)
+    target, payload, collection, persistence, analysis_plugin = _plugins(
+        LocalTargetPlugin(),
+        CommandPayloadPlugin(),
+        LocalShellCollectionPlugin(),
+        FilePersistencePlugin(),
+        RowAnalysisPlugin(),
+    )
+
+    local_commands([{"name": "sshd"}, {"name": "cron"}])
+    baseline("localhost", target, payload, collection, persistence)
+
+    # output matching the baseline, in any order, is never diffed
+    local_commands([{"name": "cron"}, {"name": "sshd"}])
+    with mock.patch.object(RowAnalysisPlugin, "analyze") as analyze:
+        result = analysis("localhost", target, payload, collection, persistence, analysis_plugin)
+    assert not analyze.called
+    assert result["analysis"][0]["diff"] == {}
+    assert result["analysis"][0]["unchanged"]
+
+    local_commands([{"name": "sshd"}, {"name": "cron"}, {"name": "nc"}])
+    result = analysis("localhost", target, payload, collection, persistence, analysis_plugin)
+    assert not result["analysis"][0]["unchanged"]
+
+    # output matching the previous analysis reuses its diff
+    with mock.patch.object(RowAnalysisPlugin, "analyze") as analyze:
+        result = analysis("localhost", target, payload, collection, persistence, analysis_plugin)
+    assert not analyze.called
+    assert result["analysis"][0]["diff"] == {"added": [{"name": "nc"}]}
+    assert result["analysis"][0]["unchanged"]
+
+
+def test_analysis_reuses_only_matching_analysis(local_commands, monkeypatch):
+    monkeypatch.setitem(CONFIG, "DIFFY_ANALYSIS_SKIP_UNCHANGED", True)
+    target, payload, collection, persistence = _plugins(
+        LocalTargetPlugin(),
+        CommandPayloadPlugin(),
+        LocalShellCollectionPlugin(),
+        FilePersistencePlugin(),
+    )
+
+    local_commands([{"name": "sshd", "port": 22}])
+    baseline("localhost", target, payload, collection, persistence)
+
+    local_commands([{"name": "sshd", "port": 2222}])
+    row = {"plugin": RowAnalysisPlugin(), "options": {"key_columns": "name"}}
+    result = analysis("localhost", target, payload, collection, persistence, row, incident_id="1")
+    assert "changed" in result["analysis"][0]["diff"]
+
+    # run specific arguments do not matter
+    result = analysis("localhost", target, payload, collection, persistence, row, incident_id="2")
+    assert result["analysis"][0]["unchanged"]
+
+    # other options, or another plugin, diff again
+    row = {"plugin": RowAnalysisPlugin(), "options": {}}
+    result = analysis("localhost", target, payload, collection, persistence, row)
+    assert not result["analysis"][0]["unchanged"]
+    assert "added" in result["analysis"][0]["diff"]
+
+    simple = {"plugin": SimpleAnalysisPlugin(), "options": {}}
+    result = analysis("localhost", target, payload, collection, persistence, simple)
+    assert not result["analysis"][0]["unchanged"]
+    assert "added" not in result["analysis"][0]["diff"]
+
+
+def test_streaming_analysis_groups_each_baseline_once(local_commands):
+    target, payload, collection, persistence, analysis_plugin = _plugins(
+        LocalTargetPlugin(),
+        CommandPayloadPlugin(),
+        LocalShellCollectionPlugin(),
+        FilePersistencePlugin(),
+        RowAnalysisPlugin(),
+    )
+
+    local_commands([{"name": "sshd"}], [{"port": 22}])
+    result = baseline("localhost", target, payload, collection, persistence)
+    assert all("row_hashes" not in b["localhost"] for b in result["baselines"])
+    assert all("row_hashes" in b for b in persistence["plugin"].get("baseline", "localhost"))
+
+    with mock.patch.object(RowAnalysisPlugin, "prepare", wraps=analysis_plugin["plugin"].prepare) as prepare:
+        analysis("localhost", target, payload, collection, persistence, analysis_plugin)
+    assert prepare.call_count == 2
+
+    # nothing about the baseline is kept on the shared plugin instance
+    assert not vars(analysis_plugin["plugin"])
+
+
+def test_analysis_uses_per_command_baselines(local_commands):
+    target, payload, collection, persistence, analysis_plugin = _plugins(
+        LocalTargetPlugin(),
+        CommandPayloadPlugin(),
+        LocalShellCollectionPlugin(),
+        FilePersistencePlugin(),
+        RowAnalysisPlugin(),
+    )
+
+    local_commands([{"name": "sshd"}], [{"port": 22}])
+    baseline("localhost", target, payload, collection, persistence)
+
+    stored = persistence["plugin"].get("baseline", "localhost")
+    assert len({b["command_hash"] for b in stored}) == 2
+
+    # the third command has no baseline and is skipped
+    local_commands([{"name": "sshd"}], [{"port": 22}, {"port": 4444}], [{"user": "root"}])
+    result = analysis("localhost", target, payload, collection, persistence, analysis_plugin)
+
+    diffs = [r["diff"] for r in result["analysis"]]
+    assert len(diffs) == 2
+    assert {} in diffs
+    assert {"added": [{"port": 4444}]} in diffs
+
+    # each command's result is kept apart
+    for r in result["analysis"]:
+        stored = persistence["plugin"].get(None, f"localhost-localhost-{r['command_hash']}")
+        assert stored["diff"] == r["diff"]
+
+
+def test_analysis_ignores_legacy_baseline(local_commands):
+    target, payload, collection, persistence, analysis_plugin = _plugins(
+        LocalTargetPlugin(),
+        CommandPayloadPlugin(),
+        LocalShellCollectionPlugin(),
+        FilePersistencePlugin(),
+        RowAnalysisPlugin(),
+    )
+
+    # a single baseline without a command hash, holding only the last command's output
+    persistence["plugin"].save("baseline", "localhost", {"instance_id": "localhost", "stdout": [{"port": 22}]})
+
+    local_commands([{"name": "sshd"}], [{"port": 22}])
+    with pytest.raises(BadArguments):
+        analysis("localhost", target, payload, collection, persistence, analysis_plugin)
+
+
+class UnhashedCollectionPlugin(LocalShellCollectionPlugin):
+    """Collects like the local shell plugin, leaving results without a command hash."""
+
+    def stream(self, targets, commands, **kwargs):
+        for k, i in super().stream(targets, commands, **kwargs):
+            del i["command_hash"]
+            yield k, i
+
+
+class BatchRowAnalysisPlugin(RowAnalysisPlugin):
+    incremental = False
+
+
+@pytest.mark.parametrize("analysis_plugin", [RowAnalysisPlugin, BatchRowAnalysisPlugin])
+def test_analysis_hashes_commands_for_collection_plugins(local_commands, analysis_plugin):
+    target, payload, collection, persistence, analysis_plugin = _plugins(
+        LocalTargetPlugin(),
+        CommandPayloadPlugin(),
+        UnhashedCollectionPlugin(),
+        FilePersistencePlugin(),
+        analysis_plugin(),
+    )
+
+    local_commands([{"name": "sshd"}], [{"port": 22}])
+    baseline("localhost", target, payload, collection, persistence)
+
+    stored = persistence["plugin"].get("baseline", "localhost")
+    assert len({b["command_hash"] for b in stored}) == 2
+
+    local_commands([{"name": "sshd"}], [{"port": 22}, {"port": 4444}])
+    result = analysis("localhost", target, payload, collection, persistence, analysis_plugin)
+
+    diffs = [r["diff"] for r in result["analysis"]]
+    assert sorted(diffs, key=len) == [{}, {"added": [{"port": 4444}]}]
@@ -0,0 +1,232 @@
+import json
+import subprocess
+import sys
+from unittest import mock
+
+import numpy as np
+
+from diffy.config import CONFIG
+from diffy.common.utils import row_hash
+from diffy.plugins.diffy_local.plugin import (
+    ClusterAnalysisPlugin,
+    ConsensusAnalysisPlugin,
+    FilePersistencePlugin,
+    LocalShellCollectionPlugin,
+    RowAnalysisPlugin,
+    SimpleAnalysisPlugin,
+    group_rows,
+)
+
+
+def _echo_command(rows, delay=0):
+    code = f"import json, time; time.sleep({delay}); print(json.dumps({rows!r}))"
+    return f"{sys.executable} -c {json.dumps(code)}"
+
+
+def test_local_shell_collection_preserves_command_order():
+    commands = [
+        _echo_command([{"name": "slow"}], delay=0.5),
+        _echo_command([{"name": "fast"}]),
+    ]
+    results = LocalShellCollectionPlugin().get("local", commands, max_workers=2)
+
+    assert list(results.keys()) == [0, 1]
+    assert results[0][0]["stdout"] == [{"name": "slow"}]
+    assert results[1][0]["stdout"] == [{"name": "fast"}]
+
+
+def test_local_shell_collection_timeout():
+    commands = [_echo_command([{"name": "slow"}], delay=5)]
+    results = LocalShellCollectionPlugin().get("local", commands, command_timeout=1)
+
+    assert results[0][0]["status"] == "TimedOut"
+    assert results[0][0]["stderr"]
+
+
+def test_row_analysis():
+    baseline = {
+        "stdout": [
+            {"name": "sshd", "port": 22, "cmdline": "/usr/sbin/sshd"},
+            {"name": "nginx", "port": 80, "cmdline": "nginx"},
+            {"name": "cron", "port": 0, "cmdline": "cron"},
+        ]
+    }
+    items = [
+        {"instance_id": "i-1", "stdout": list(baseline["stdout"])},
+        {
+            "instance_id": "i-2",
+            "stdout": [
+                {"name": "sshd", "port": 22, "cmdline": "/usr/sbin/sshd"},
+                {"name": "nginx", "port": 80, "cmdline": "nginx -g daemon"},
+                {"name": "nc", "port": 4444, "cmdline": "nc -l 4444"},
+            ],
+        },
+    ]
+
+    results = RowAnalysisPlugin().run(
+        items, baseline=baseline, key_columns="name, port"
+    )
+
+    assert results[0]["diff"] == {}
+    assert results[1]["diff"] == {
+        "added": [{"name": "nc", "port": 4444, "cmdline": "nc -l 4444"}],
+        "removed": [{"name": "cron", "port": 0, "cmdline": "cron"}],
+        "changed": [
+            {
+                "baseline": {"name": "nginx", "port": 80, "cmdline": "nginx"},
+                "current": {"name": "nginx", "port": 80, "cmdline": "nginx -g daemon"},
+            }
+        ],
+    }
+
+
+def test_row_analysis_multiset():
+    baseline = {"stdout": [{"name": "worker"}]}
+    items = [{"instance_id": "i-1", "stdout": [{"name": "worker"}, {"name": "worker"}]}]
+
+    results = RowAnalysisPlugin().run(items, baseline=baseline)
+    assert results[0]["diff"] == {"added": [{"name": "worker"}]}
+
+
+def test_cluster_analysis_flags_outlier():
+    common = [{"name": "sshd", "port": 22}, {"name": "nginx", "port": 80}]
+    items = [{"instance_id": f"i-{n}", "stdout": list(common)} for n in range(20)]
+    items.append(
+        {
+            "instance_id": "i-bad",
+            "stdout": [{"name": "sshd", "port": 22}, {"name": "nc", "port": 4444}],
+        }
+    )
+
+    results = ClusterAnalysisPlugin().run(items)
+
+    flagged = [r for r in results if r["diff"]]
+    assert [r["instance_id"] for r in flagged] == ["i-bad"]
+    assert flagged[0]["diff"]["added"] == [{"name": "nc", "port": 4444}]
+    assert flagged[0]["diff"]["removed"] == [{"name": "nginx", "port": 80}]
+    assert all(r["score"] == 0 for r in results[:20])
+
+
+def test_cluster_analysis_explicit_zero_threshold():
+    # each instance has one more unique row than the last, spreading the scores out
+    items = [
+        {"instance_id": f"i-{n}", "stdout": [{"name": "sshd"}] + [{"name": f"{n}-{k}"} for k in range(n)]}
+        for n in range(7)
+    ]
+
+    assert not [r for r in ClusterAnalysisPlugin().run(items) if r["diff"]]
+
+    flagged = [r["instance_id"] for r in ClusterAnalysisPlugin().run(items, outlier_threshold=0) if r["diff"]]
+    assert flagged == ["i-4", "i-5", "i-6"]
+
+
+def test_find_outliers_without_spread():
+    from diffy.plugins.diffy_local.cluster import find_outliers
+
+    assert not find_outliers(np.zeros(10), 3.0).any()
+    assert find_outliers(np.array([0.0] * 9 + [0.5]), 3.0).tolist() == [False] * 9 + [True]
+
+
+def test_local_plugins_do_not_import_scipy():
+    code = (
+        "import sys;"
+        "from diffy.plugins.diffy_local.plugin import FilePersistencePlugin;"
+        "assert 'scipy' not in sys.modules and 'numpy' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_consensus_analysis_reports_rare_rows():
+    common = [{"name": "sshd", "port": 22}]
+    items = [{"instance_id": f"i-{n}", "stdout": list(common)} for n in range(19)]
+    items.append(
+        {"instance_id": "i-bad", "stdout": common + [{"name": "nc", "port": 4444}]}
+    )
+
+    results = ConsensusAnalysisPlugin().run(items, consensus_threshold=10)
+
+    assert all(not r["diff"] for r in results[:19])
+    assert results[19]["diff"] == {
+        "rare": [{"row": {"name": "nc", "port": 4444}, "frequency": 0.05}]
+    }
+
+
+def test_consensus_analysis_explicit_zero_threshold():
+    items = [{"instance_id": f"i-{n}", "stdout": [{"name": "sshd"}]} for n in range(19)]
+    items.append({"instance_id": "i-bad", "stdout": [{"name": "sshd"}, {"name": "nc"}]})
+
+    assert ConsensusAnalysisPlugin().run(items)[19]["diff"]
+    assert not [r for r in ConsensusAnalysisPlugin().run(items, consensus_threshold=0) if r["diff"]]
+
+
+def test_content_addressed_file_persistence(local_file_directory, monkeypatch):
+    monkeypatch.setitem(CONFIG, "DIFFY_LOCAL_FILE_CONTENT_ADDRESSED", True)
+
+    stdout = [{"name": "sshd", "port": 22}]
+    plugin = FilePersistencePlugin()
+    for n in range(3):
+        plugin.save(None, f"asg-i-{n}", {"instance_id": f"i-{n}", "stdout": stdout})
+
+    assert len(local_file_directory.join("blobs").listdir()) == 1
+    assert json.loads(local_file_directory.join("asg-i-1.json").read())["stdout"] != stdout
+    assert plugin.get(None, "asg-i-1") == {"instance_id": "i-1", "stdout": stdout}
+
+
+def test_file_persistence_index(local_file_directory):
+    # files written before the index existed are picked up when it is first built
+    local_file_directory.join("baseline-legacy.json").write(json.dumps({"instance_id": "i-0"}))
+
+    plugin = FilePersistencePlugin()
+    plugin.save("baseline", "asg", {"instance_id": "i-1", "collected_at": "2018-01-01"})
+    plugin.save("analysis", "asg", [{"instance_id": "i-1"}, {"instance_id": "i-2"}])
+
+    entries = plugin.list("baseline")["items"]
+    assert [e["key"] for e in entries] == ["asg", "legacy"]
+    assert entries[0]["collected_at"] == "2018-01-01"
+    assert plugin.list("analysis")["items"][0]["instances"] == 2
+    assert len(plugin.get_all("baseline")) == 2
+
+    page = plugin.list("baseline", limit=1)
+    assert page["total"] == 2
+    assert [e["key"] for e in page["items"]] == ["asg"]
+
+    page = plugin.list("baseline", limit=1, cursor=page["cursor"])
+    assert [e["key"] for e in page["items"]] == ["legacy"]
+
+
+def test_file_persistence_index_reconciles_directory(local_file_directory):
+    plugin = FilePersistencePlugin()
+    plugin.save("baseline", "asg", {"instance_id": "i-1"})
+    assert [e["key"] for e in plugin.list("baseline")["items"]] == ["asg"]
+
+    # files written by other processes, or removed, after the index was built
+    local_file_directory.join("baseline-copied.json").write(json.dumps({"instance_id": "i-2"}))
+    local_file_directory.join("baseline-asg.json").remove()
+
+    assert [e["key"] for e in plugin.list("baseline")["items"]] == ["copied"]
+
+
+def test_row_analysis_uses_baseline_row_index():
+    stdout = [{"name": "sshd"}, {"name": "cron"}]
+    baseline = {"stdout": stdout, "row_hashes": [row_hash(r) for r in stdout]}
+    items = [{"instance_id": f"i-{n}", "stdout": list(stdout)} for n in range(3)]
+    items.append({"instance_id": "i-bad", "stdout": stdout + [{"name": "nc"}]})
+
+    plugin = RowAnalysisPlugin()
+    with mock.patch("diffy.plugins.diffy_local.plugin.group_rows", wraps=group_rows) as grouped:
+        results = plugin.run(items, baseline=baseline)
+
+    # the baseline is grouped once, then each instance once
+    assert grouped.call_count == len(items) + 1
+    assert [r["diff"] for r in results] == [{}, {}, {}, {"added": [{"name": "nc"}]}]
+
+
+def test_simple_analysis_skips_diff_of_identical_output():
+    stdout = [{"name": "sshd"}]
+    baseline = {"stdout": stdout, "row_hashes": [row_hash(r) for r in stdout]}
+
+    with mock.patch("diffy.plugins.diffy_local.plugin.diff") as diff:
+        result = SimpleAnalysisPlugin().analyze({"stdout": list(stdout)}, baseline=baseline)
+
+    assert not diff.called
+    assert result["diff"] == {}
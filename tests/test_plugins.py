@@ -0,0 +1,61 @@
+import subprocess
+import sys
+
+import pytest
+
+from diffy.plugins.base import plugins
+
+
+def test_plugin_get_imports_only_what_it_needs():
+    code = (
+        "import sys;"
+        "from diffy.common.utils import install_plugins;"
+        "from diffy.plugins.base import plugins;"
+        "install_plugins();"
+        "assert plugins.get('local-file').slug == 'local-file';"
+        "assert 'diffy.plugins.diffy_aws.plugin' not in sys.modules;"
+        "assert 'boto3' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_plugin_get_unknown_slug():
+    with pytest.raises(KeyError):
+        plugins.get("does-not-exist")
+
+
+def test_plugin_index_follows_registration():
+    from diffy.plugins.base import PluginManager
+    from diffy.plugins.diffy_local.plugin import FilePersistencePlugin, LocalTargetPlugin
+
+    manager = PluginManager()
+    manager.register(FilePersistencePlugin)
+    manager.register(LocalTargetPlugin)
+
+    assert manager.get("local-file").slug == "local-file"
+    assert manager.get("local-target", plugin_type="target").type == "target"
+    assert set(manager.index) == {"local-file", "local-target"}
+
+    with pytest.raises(KeyError):
+        manager.get("local-target", plugin_type="persistence")
+
+    manager.unregister(FilePersistencePlugin)
+    assert "local-file" not in manager.index
+    with pytest.raises(KeyError):
+        manager.get("local-file")
+
+
+def test_resolve_plugin_slug_unknown():
+    from marshmallow.exceptions import ValidationError
+
+    from diffy.schema import resolve_plugin_slug
+
+    with pytest.raises(ValidationError):
+        resolve_plugin_slug("does-not-exist")
+
+
+def test_persistence_plugin_version_is_a_string():
+    persistence = plugins.all(plugin_type="persistence")
+    assert persistence
+    for p in persistence:
+        assert isinstance(p.version, str)
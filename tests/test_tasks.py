@@ -0,0 +1,35 @@
+import pytest
+from diffy_api.tasks.views import *  # noqa
+
+
+@pytest.mark.parametrize("token,status", [("", 405)])
+def test_task_list_post(client, token, status):
+    assert client.post(api.url_for(TaskList), data={}, headers=token).status_code == status
+
+
+def test_task_list_pagination(client, run_fan_out_analysis, rq_connection):
+    targets = [f"i-{n}" for n in range(5)]
+    job = run_fan_out_analysis(targets)
+
+    # the parent, three chunks and the reducer
+    resp = client.get(api.url_for(TaskList, limit=3))
+    assert resp.status_code == 200
+    assert resp.json["total"] == 5
+    assert len(resp.json["items"]) == 3
+    assert all(i["status"] == "finished" for i in resp.json["items"])
+    first_page = [i["id"] for i in resp.json["items"]]
+    assert first_page[0] == job.id
+
+    # a task changing state between pages neither skips nor repeats tasks
+    queue = rq.get_queue()
+    moved = queue.fetch_job(first_page[1])
+    queue.finished_job_registry.remove(moved)
+    queue.failed_job_registry.add(moved, exc_string="failed")
+
+    resp = client.get(api.url_for(TaskList, limit=3, cursor=resp.json["cursor"]))
+    assert len(resp.json["items"]) == 2
+    assert "cursor" not in resp.json or resp.json["cursor"] is None
+    assert not set(first_page) & {i["id"] for i in resp.json["items"]}
+
+    resp = client.get(api.url_for(Task, task_id=job.id))
+    assert resp.json["progress"] == {"targeted": 5, "collected": 5, "diffed": 5, "persisted": 5}